@@ -28,19 +28,41 @@ up to the first empty line.
 
 
 import argparse
+import collections
+import concurrent.futures
+import codecs
+import hashlib
+import io
+import itertools
 import json
+import locale
 import os
 import mimetypes
 import logging
+import mmap
 import re
+import stat
 import sys
+import threading
+import time
 from pathlib import Path
 import fnmatch
 
 try:
+    from fsoft_maid.lib import inotify
+    from fsoft_maid.lib.git_index import find_repository, tracked_files
     from fsoft_maid.lib.pattern_matcher import PatternMatcher
+    from fsoft_maid.lib.render_cache import (
+        RenderCache,
+        content_digest,
+        default_cache_dir,
+        now_ns,
+    )
 except ImportError:
+    from lib import inotify
+    from lib.git_index import find_repository, tracked_files
     from lib.pattern_matcher import PatternMatcher
+    from lib.render_cache import RenderCache, content_digest, default_cache_dir, now_ns
 
 VERSION = "0.4.7"
 
@@ -100,6 +122,14 @@ _binaries = set(
     ]
 )  # This is a list of extensions that are considered binary files
 
+# Extensions given with --no-binary: these files are never told binary by their
+# signature
+_text_exts = set()
+
+# How the other files are told apart: "fast" sniffs their first bytes, "strict"
+# decodes them whole
+_binary_detection = "fast"
+
 PROFILES = {
     "c#": {
         "patterns": [
@@ -189,145 +219,970 @@ def _ext2markdown(fname):
 
 matcher = PatternMatcher(PATTERNS)
 
+_UTF16_BOMS = (b"\xfe\xff", b"\xff\xfe")
+
+# The encoding of open() in text mode, used to tell text files from binary ones
+_LOCALE_ENCODING = locale.getpreferredencoding(False)
+_LOCALE_UTF8 = codecs.lookup(_LOCALE_ENCODING).name == "utf-8"
+
+# The bytes sniffed by the fast binary detection
+SNIFF_SIZE = 8192
+
+# Files with more control characters than this (besides whitespace and escape)
+# in their first bytes are binary
+_CONTROL_RATIO = 0.3
+_CONTROL_BYTES = bytes(sorted(set(range(32)) - set(b"\t\n\v\f\r\x1b")))
+
+# Signatures made of these bytes only may well start a text file
+_PRINTABLE_BYTES = bytes(range(0x20, 0x7F)) + b"\t\n\r"
+
+# Text files this large are rendered from a memory map, a block of about
+# _MMAP_BLOCK bytes at a time, when the output is streamed
+MMAP_THRESHOLD = 16 << 20
+_MMAP_BLOCK = 1 << 20
+
+# Lines kept from the head and the tail of a sampled file, by default. They are
+# read in blocks of _SAMPLE_BLOCK bytes, until enough lines are found.
+SAMPLE_HEAD = 100
+SAMPLE_TAIL = 20
+_SAMPLE_BLOCK = 64 << 10
+_sample_head = SAMPLE_HEAD
+_sample_tail = SAMPLE_TAIL
+
+# Signatures ("magic numbers") of binary formats, checked on the first
+# SIGNATURE_SIZE bytes of every file before it is decoded, as
+# `(offset, signature, MIME type)` tuples. More can be added by maid.json files.
+SIGNATURE_SIZE = 16
+SIGNATURES = [
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"\x00\x00\x01\x00", "image/vnd.microsoft.icon"),
+    (0, b"8BPS", "image/vnd.adobe.photoshop"),
+    (0, b"RIFF", "application/x-riff"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"PK\x05\x06", "application/zip"),
+    (0, b"PK\x07\x08", "application/zip"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"BZh", "application/x-bzip2"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz"),
+    (0, b"\x28\xb5\x2f\xfd", "application/zstd"),
+    (0, b"\x04\x22\x4d\x18", "application/x-lz4"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),
+    (0, b"SQLite format 3\x00", "application/vnd.sqlite3"),
+    (0, b"\x7fELF", "application/x-executable"),
+    (0, b"\xfe\xed\xfa\xce", "application/x-mach-binary"),
+    (0, b"\xfe\xed\xfa\xcf", "application/x-mach-binary"),
+    (0, b"\xce\xfa\xed\xfe", "application/x-mach-binary"),
+    (0, b"\xcf\xfa\xed\xfe", "application/x-mach-binary"),
+    (0, b"\xca\xfe\xba\xbe", "application/java-vm"),
+    (0, b"\x00asm", "application/wasm"),
+    (0, b"wOFF", "font/woff"),
+    (0, b"wOF2", "font/woff2"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"\x1a\x45\xdf\xa3", "video/x-matroska"),
+    (4, b"ftyp", "video/mp4"),
+]
 
-def is_binary(file_path):
-    """
-    Check if a file is binary, handling UTF-16 files with BOM.
-    """
 
+def _has_binary_ext(file_path):
     #  get the file extension (lowercase, without the dot)
     ext = os.path.splitext(file_path)[1]
     ext = ext.lower().replace(".", "")
-    if ext in _binaries:
-        _files_binaries.append(file_path)
-        return True
+    return ext in _binaries
+
+
+def _has_text_ext(file_path):
+    # Whether the file has an extension given with --no-binary
+    ext = os.path.splitext(file_path)[1]
+    return ext.lower().replace(".", "") in _text_exts
+
+
+def _sniff_text(head, complete=False):
+    """
+    Tell from its first bytes whether a file is a text file.
+
+    A text file has no NUL bytes, few control characters and is valid in the
+    default encoding. A character cut at the end of `head` is fine, unless
+    `complete` tells that `head` is the whole file.
+    """
+    if b"\0" in head:
+        return False
+
+    controls = len(head) - len(head.translate(None, _CONTROL_BYTES))
+    if controls > len(head) * _CONTROL_RATIO:
+        return False
 
     try:
-        # Check first few bytes for UTF-16 BOM
-        with open(file_path, "rb") as check_file:
-            header = check_file.read(2)
-            if header.startswith(b"\xfe\xff") or header.startswith(b"\xff\xfe"):
-                return False
+        codecs.getincrementaldecoder(_LOCALE_ENCODING)().decode(head, complete)
+    except UnicodeDecodeError:
+        return False
+    return True
 
-        # Try reading as regular text
-        with open(file_path, "rt") as check_file:
-            check_file.read()
-            return False
-    except (IOError, OSError, UnicodeDecodeError):
-        _files_binaries.append(file_path)
+
+def _compile_signatures(rules=()):
+    """
+    Build the table of signatures for `_match_signature()`: the `SIGNATURES` and
+    the ones added to `rules` by maid.json files.
+
+    Returns:
+        A list of `(offset, signatures, MIME types)` tuples, one per offset.
+    """
+    signatures = SIGNATURES + [
+        (rule["offset"], bytes.fromhex(rule["signature"]), rule["type"])
+        for rule in rules
+        if "signature" in rule
+    ]
+
+    by_offset = {}
+    for offset, signature, file_type in signatures:
+        by_offset.setdefault(offset, []).append((signature, file_type))
+    return [
+        (offset, tuple(s for s, _ in items), tuple(t for _, t in items))
+        for offset, items in by_offset.items()
+    ]
+
+
+# The table of the built-in signatures
+_SIGNATURE_TABLE = _compile_signatures()
+
+
+def _match_signature(head, signatures):
+    """
+    Return the `(signature, MIME type)` of the signature `head` starts with, None
+    if none does.
+    """
+    for offset, magics, types in signatures:
+        # A single call tells whether any signature matches
+        if head.startswith(magics, offset):
+            for magic, file_type in zip(magics, types):
+                if head.startswith(magic, offset):
+                    return magic, file_type
+    return None
+
+
+def _classify(f, file_path, signatures=None, keep=False):
+    """
+    Tell a text file from a binary one, reading it from `f` (a file or a memory
+    map, at its start). All the readers of files go through this.
+
+    The signatures are checked first, on the first `SIGNATURE_SIZE` bytes: only
+    those are read from a file with a signature holding non-printable bytes.
+    A printable signature (eg. "ID3" or "%PDF-") may well start a text file: it
+    only tells the type of a file that does not look like text at first sight.
+    The files with a --no-binary extension are not checked against signatures.
+    Files starting with a UTF-16 BOM are text files. The others are checked as
+    set by `_binary_detection`: "fast" sniffs the first `SNIFF_SIZE` bytes,
+    "strict" decodes the whole file with the default encoding, a block at a
+    time.
+
+    Args:
+        f (file): The file, opened in binary mode.
+        file_path (str): The path of the file, for its extension.
+        signatures (list): The table of `_compile_signatures()`, None for the
+            built-in signatures.
+        keep (bool): Return the whole content read in "strict" mode, rather
+            than its first bytes.
+
+    Returns:
+        A `(kind, head, file_type)` tuple. `kind` is "binary", "utf-16" or
+        "text", `head` holds the bytes read from the start of the file: the
+        first `SNIFF_SIZE` ones (or less, if the file is shorter), unless a
+        signature matched or the whole file was kept. `file_type` is the MIME
+        type of the matching signature, if any. `f` is left after the bytes
+        read.
+    """
+    if signatures is None:
+        signatures = _SIGNATURE_TABLE
+
+    head = f.read(SIGNATURE_SIZE)
+    match = None
+    if not _has_text_ext(file_path):
+        match = _match_signature(head, signatures)
+    if match is not None and match[0].translate(None, _PRINTABLE_BYTES):
+        return "binary", head, match[1]
+
+    if len(head) == SIGNATURE_SIZE:
+        head += f.read(SNIFF_SIZE - len(head))
+    if match is not None and not _sniff_text(head, len(head) < SNIFF_SIZE):
+        return "binary", head, match[1]
+    if head[:2] in _UTF16_BOMS:
+        return "utf-16", head, None
+
+    if _binary_detection != "strict":
+        text = _sniff_text(head, len(head) < SNIFF_SIZE)
+        return ("text" if text else "binary"), head, None
+
+    if keep:
+        data = head + f.read() if len(head) == SNIFF_SIZE else head
+        try:
+            data.decode(_LOCALE_ENCODING)
+        except UnicodeDecodeError:
+            return "binary", head, None
+        return "text", data, None
+
+    decoder = codecs.getincrementaldecoder(_LOCALE_ENCODING)()
+    try:
+        decoder.decode(head)
+        for block in iter(lambda: f.read(_MMAP_BLOCK), b""):
+            decoder.decode(block)
+        decoder.decode(b"", True)
+    except UnicodeDecodeError:
+        return "binary", head, None
+    return "text", head, None
+
+
+def _read_text(file_path, signatures=None):
+    """
+    Read a file and decode it, telling text files from binary ones with
+    `_classify()`: only the first bytes of a binary file are read, except in
+    "strict" mode.
+
+    Args:
+        file_path (str): The file.
+        signatures (list): The table of `_compile_signatures()`, None for the
+            built-in signatures.
+
+    Returns:
+        A `(data, text, file_type)` tuple with the content of the file and its
+        text, both None for a binary file. `file_type` is the MIME type of the
+        matching signature, if any.
+
+    Raises:
+        OSError: If the file cannot be read.
+        UnicodeDecodeError: If a file with a UTF-16 BOM is not valid UTF-16.
+    """
+    with open(file_path, "rb") as f:
+        kind, data, file_type = _classify(f, file_path, signatures, keep=True)
+        if kind == "binary":
+            return None, None, file_type
+        # Only a file as long as the bytes sniffed may go on
+        if len(data) == SNIFF_SIZE:
+            data += f.read()
+
+    if kind == "utf-16":
+        return data, data.decode("utf-16"), None
+    return data, data.decode("utf-8", errors="ignore"), None
+
+
+def is_binary(file_path):
+    """
+    Check if a file is binary, by its extension and then with `_classify()`.
+    """
+    if _has_binary_ext(file_path):
         return True
 
+    try:
+        with open(file_path, "rb") as f:
+            return _classify(f, file_path)[0] == "binary"
+    except OSError:
+        return True
+
+
+def _is_rule(rule):
+    # The rules list also holds the signatures and the sampling settings of the
+    # maid.json files, so that they have the same scope
+    return "signature" not in rule and "sample_size" not in rule
+
+
+def _compile_rules(rules):
+    """
+    Compile the regular expressions of a list of rules, for `_apply_rules()`.
+    The signatures and sampling settings added to the list by maid.json files
+    are left out, see `_compile_signatures()` and `_compile_sampling()`.
+
+    Compiled rules can be pickled, so they can be sent to the rendering processes.
+
+    Returns:
+        A list of `(name, pattern, start, delete, delete_regex, keep_start)`
+        tuples, `pattern`, `start` and `delete_regex` being compiled regexes.
+    """
+    return [
+        (
+            rule["name"],
+            re.compile(fnmatch.translate(rule["pattern"])),
+            re.compile(rule["start"]),
+            rule["delete"],
+            re.compile(rule["delete"]),
+            rule.get("keep_start", False),
+        )
+        for rule in rules
+        if _is_rule(rule)
+    ]
+
 
 def _apply_rules(file_name, content, rules):
-    import logging
+    """
+    Apply the rules compiled by `_compile_rules()` to the lines of a file.
+    """
+    return "".join(_stream_rules(file_name, content, rules))
+
 
-    do_debug = False
+def _stream_rules(file_name, lines, rules):
+    """
+    Apply the rules compiled by `_compile_rules()` to the lines of a file, as a
+    generator: the lines are read from the `lines` iterable and yielded one at a
+    time, so a file never has to be kept in memory.
+
+    Every rule drops the ranges of lines from a line matching its start regex to
+    the first line matching its delete regex (or empty, for "::empty::"), or to
+    the end of the file. The start line is kept with `keep_start`, "::line::"
+    ranges are a single line. Rules are applied one after the other, each to the
+    lines left by the previous ones.
+    """
+    # Same as fnmatch.fnmatch(), with the patterns compiled once
+    name = os.path.normcase(os.fspath(file_name))
 
     for rule in rules:
-        if do_debug:
-            print(
-                "=== RULE: ",
-                file_name,
-                rule["name"],
-                rule["pattern"],
-                fnmatch.fnmatch(file_name, rule["pattern"]),
-            )
-        if fnmatch.fnmatch(file_name, rule["pattern"]):
-            logging.info(f"Applying rule: {rule['name']} to {file_name}")
-
-            match_regex = re.compile(rule["start"])
-            delete_pattern = rule["delete"]
-            delete_regex = re.compile(delete_pattern)
-            keep_match = rule.get("keep_start", False)
-            indices_to_delete = []
-
-            i = 0
-            while i < len(content):
-                line = content[i]
-                if match_regex.search(line):
-                    # print("=== START MATCH: ", line)
-                    if keep_match:
-                        start = i + 1
-                    else:
-                        start = i
-
-                    end = None
-                    j = start
-
-                    if delete_pattern == "::line::":
-                        end = start
-                    else:
-                        while j < len(content):
-                            delete_line = content[j]
-                            if (
-                                delete_pattern == "::empty::"
-                                and not delete_line.strip()
-                            ):
-                                end = j
-                                break
-                            if delete_regex.search(delete_line):
-                                # print("=== END MATCH: ", delete_line)
-                                end = j
-                                break
-                            j += 1
-                    if end is None:
-                        end = len(content) - 1
-                    indices_to_delete.append((start, end))
-                    i = end + 1
-                else:
-                    i += 1
+        if rule[1].match(name):
+            logging.info(f"Applying rule: {rule[0]} to {file_name}")
+            lines = _stream_rule(lines, rule)
+
+    return iter(lines)
+
+
+def _stream_rule(lines, rule):
+    _, _, match_regex, delete_pattern, delete_regex, keep_match = rule
+    single = delete_pattern == "::line::"
+    empty = delete_pattern == "::empty::"
+
+    # The next line is: kept unless it starts a range (None), dropped as the
+    # whole range ("line"), or dropped up to the end of the range ("range")
+    dropping = None
+    for line in lines:
+        if dropping is None:
+            if not match_regex.search(line):
+                yield line
+                continue
+            if keep_match:
+                yield line
+                dropping = "line" if single else "range"
+                continue
+            if single:
+                continue
+            dropping = "range"
+        elif dropping == "line":
+            dropping = None
+            continue
+
+        # Dropping the lines of a range, up to and including its last line
+        if (empty and not line.strip()) or delete_regex.search(line):
+            dropping = None
+
+
+def _compile_sampling(rules):
+    """
+    Compile the sampling settings added to `rules` by maid.json files and by
+    `--sample-size`, for `_sample_limits()`.
 
-            for start, end in reversed(indices_to_delete):
-                # logging.info(f"Deleting lines {start} to {end} in {file_name}")
-                del content[start : end + 1]
+    Returns:
+        A list of `(pattern, sample_size, head, tail)` tuples, `pattern` being
+        a compiled regex matched like the pattern of a rule.
+    """
+    return [
+        (
+            re.compile(fnmatch.translate(rule["pattern"])),
+            rule["sample_size"],
+            rule["head"],
+            rule["tail"],
+        )
+        for rule in rules
+        if "sample_size" in rule
+    ]
 
-            # open(f"/ramdisk/step-{rule['name']}.txt", "w").write("".join(content))
 
-    return "".join(content)
+def _sample_limits(file_path, entry, sampling):
+    """
+    Return the `(size, sample_size, head, tail)` of a file to sample, or None
+    if the file is not larger than its `sample_size`.
+
+    The last setting matching the file wins, so the ones of a subdirectory
+    override the ones of its parents.
+    """
+    if not sampling:
+        return None
 
+    name = os.path.normcase(os.fspath(file_path))
+    for pattern, sample_size, head, tail in reversed(sampling):
+        if pattern.match(name):
+            break
+    else:
+        return None
 
-def process_file(file_path, markdown_content, rules):
+    try:
+        size = (entry.stat() if entry is not None else os.stat(file_path)).st_size
+    except OSError:
+        return None
+    if size <= sample_size:
+        return None
+    return size, sample_size, head, tail
+
+
+def _head_lines(data, count):
+    # The first `count` lines of `data`, or all its whole lines if it has fewer
+    pos = -1
+    for _ in range(count):
+        pos = data.find(b"\n", pos + 1)
+        if pos < 0:
+            return data[: data.rfind(b"\n") + 1]
+    return data[: pos + 1]
+
+
+def _tail_lines(data, count, whole):
+    # The last `count` lines of `data`, or all its lines if it has fewer. Unless
+    # `whole`, the first line of `data` is cut and it is left out.
+    if count <= 0:
+        return b""
+
+    pos = len(data) - 1 if data.endswith(b"\n") else len(data)
+    for _ in range(count):
+        pos = data.rfind(b"\n", 0, pos)
+        if pos < 0:
+            break
+    else:
+        return data[pos + 1 :]
+
+    if whole:
+        return data
+    return data[data.find(b"\n") + 1 :] if b"\n" in data else b""
+
+
+def _read_head(f, data, count, limit):
+    # The first `count` lines of a file, given its first bytes `data`: blocks are
+    # read until there are enough lines, up to `limit` bytes
+    newlines = data.count(b"\n")
+    length = len(data)
+    blocks = [data]
+    f.seek(length)
+    while newlines < count and length < limit:
+        block = f.read(min(_SAMPLE_BLOCK, limit - length))
+        if not block:
+            break
+        newlines += block.count(b"\n")
+        length += len(block)
+        blocks.append(block)
+    return _head_lines(b"".join(blocks)[:limit], count)
+
+
+def _read_tail(f, size, count, start, limit):
+    # The last `count` lines of a file of `size` bytes, not before `start`:
+    # blocks are read backwards until there are enough lines, up to `limit` bytes
+    if count <= 0:
+        return b""
+
+    lowest = max(size - limit, start)
+    pos = size
+    blocks = []
+    newlines = 0
+    trailing = None
+    while pos > lowest:
+        length = min(_SAMPLE_BLOCK, pos - lowest)
+        pos -= length
+        f.seek(pos)
+        block = f.read(length)
+        blocks.append(block)
+        if trailing is None:
+            trailing = block.endswith(b"\n")
+        newlines += block.count(b"\n")
+        # The line before the first one kept must end in the data too
+        if newlines - trailing >= count:
+            break
+
+    data = b"".join(reversed(blocks))
+    whole = pos == start
+    if not whole and pos == lowest:
+        # The byte before the data tells whether it starts with a whole line
+        f.seek(pos - 1)
+        whole = f.read(1) == b"\n"
+    return _tail_lines(data, count, whole)
+
+
+def _render_sample(file_path, rules, limits, entry=None, signatures=None):
     """
-    Process a single file and add its content to the markdown.
+    Render the head and the tail of a file larger than its `sample_size`,
+    reading only them: the tail is read backwards from the end of the file.
+
+    The head and the tail are read a block at a time until they have enough
+    lines, and are at most `sample_size / 2` bytes each. The rules are applied
+    to each of them. Between them a marker gives the exact number of
+    bytes omitted and the number of lines, estimated from the ones sampled.
+    Binary files are told by `_classify()`, so in "strict" mode the whole file is
+    still decoded to check it.
+
+    Returns:
+        A `(chunk, binary, None)` tuple, or None if the file is not to be sampled
+        (UTF-16 files).
     """
-    _files_included.append(file_path)
-    file_path = Path(file_path)
-    if is_binary(file_path):
-        file_type = mimetypes.guess_type(file_path)[0] or "Unknown"
-        file_size = file_path.stat().st_size
-        markdown_content.append(("-" * 40) + "\n")
-        markdown_content.append(
-            f"## FILE: `{file_path}` - Type: {file_type} - Size: {file_size} bytes\n"
+    size, sample_size, head_count, tail_count = limits
+    half = sample_size // 2
+
+    with open(file_path, "rb") as f:
+        kind, head, signature_type = _classify(f, file_path, signatures)
+        if kind == "utf-16":
+            return None
+        if kind == "binary":
+            return _binary_chunk(file_path, entry, signature_type), True, None
+
+        head = _read_head(f, head, head_count, half)
+        tail = _read_tail(f, size, tail_count, len(head), half)
+
+    logging.info(f"Sampling file: {file_path} ({size} bytes)")
+
+    sampled = len(head) + len(tail)
+    omitted = size - sampled
+    newlines = head.count(b"\n") + tail.count(b"\n")
+    marker = f"[... {omitted} bytes"
+    if newlines:
+        marker += f" (~{round(omitted * newlines / sampled)} lines)"
+    marker += " omitted ...]\n"
+
+    head_text, tail_text = [
+        _apply_rules(
+            file_path,
+            io.StringIO(data.decode("utf-8", errors="ignore"), newline=None),
+            rules,
         )
-    else:
-        logging.info(f"Processing file: {file_path}")
+        for data in (head, tail)
+    ]
+    if head_text and not head_text.endswith("\n"):
+        head_text += "\n"
+
+    ext = _ext2markdown(file_path)
+    content = head_text + marker + tail_text
+    if ext == "markdown":
+        content = content.replace("```", "'''")
+    chunk = [("-" * 40) + "\n\n", f"## FILE: `{file_path}`\n\n", "```%s\n" % ext]
+    chunk.append(content)
+    chunk.append("```\n\n")
+    return "".join(chunk), False, None
+
 
-        # Try reading with UTF-16 first if it has BOM
+def render_file(file_path, rules, entry=None, signatures=None, sampling=None):
+    """
+    Render a single file as a Markdown chunk.
+
+    `rules` are compiled by `_compile_rules()`, `signatures` by
+    `_compile_signatures()` (None for the built-in ones) and `sampling` by
+    `_compile_sampling()`: the text files larger than their `sample_size` are
+    rendered as their first and last lines, see `_render_sample()`. `entry` is
+    the os.DirEntry of the file, if available: its cached stat info is used
+    instead of querying the file system again.
+
+    Returns:
+        A `(chunk, binary)` tuple, `binary` is True if the file is treated as a
+        binary file.
+    """
+    chunk, binary, _ = _render(file_path, rules, entry, signatures, sampling)
+    return chunk, binary
+
+
+def _render(file_path, rules, entry=None, signatures=None, sampling=None):
+    # Same as render_file(), also returning the content the chunk was rendered
+    # from (None for binary and sampled files). The file is read once, its
+    # bytes are checked and decoded in memory.
+    file_path = Path(file_path)
+    data = text = error = signature_type = None
+    if not _has_binary_ext(file_path):
+        limits = _sample_limits(file_path, entry, sampling)
+        if limits is not None:
+            try:
+                sample = _render_sample(file_path, rules, limits, entry, signatures)
+            except OSError:
+                sample = None
+            if sample is not None:
+                return sample
         try:
-            with open(file_path, "rb") as f:
-                header = f.read(2)
-                f.seek(0)
-                if header.startswith(b"\xfe\xff") or header.startswith(b"\xff\xfe"):
-                    content = open(file_path, "r", encoding="utf-16").readlines()
-                else:
-                    content = open(
-                        file_path, "r", encoding="utf-8", errors="ignore"
-                    ).readlines()
-        except Exception as e:
-            logging.warning(f"Error reading file {file_path}: {e}")
-            content = []
+            data, text, signature_type = _read_text(file_path, signatures)
+        except OSError:
+            pass
+        except UnicodeDecodeError as e:
+            error = e
+            text = ""
+
+    if text is None:
+        return _binary_chunk(file_path, entry, signature_type), True, None
+
+    logging.info(f"Processing file: {file_path}")
+    if error is not None:
+        logging.warning(f"Error reading file {file_path}: {error}")
+
+    # The same lines (and universal newlines) as readlines() of a text file
+    content = io.StringIO(text, newline=None).readlines()
+    content = _apply_rules(file_path, content, rules)
+
+    ext = _ext2markdown(file_path)
+    chunk = [("-" * 40) + "\n\n", f"## FILE: `{file_path}`\n\n", "```%s\n" % ext]
+    if ext == "markdown":
+        content = content.replace("```", "'''")
+
+    chunk.append(content)
+    chunk.append("```\n\n")
+    return "".join(chunk), False, data
+
+
+def _binary_chunk(file_path, entry=None, signature_type=None):
+    # The chunk of a binary file, its type and size
+    file_type = mimetypes.guess_type(file_path)[0] or signature_type or "Unknown"
+    file_stat = entry.stat() if entry is not None else file_path.stat()
+    file_size = file_stat.st_size
+    return (
+        ("-" * 40)
+        + "\n"
+        + f"## FILE: `{file_path}` - Type: {file_type} - Size: {file_size} bytes\n"
+    )
+
+
+def _is_large(file_path, entry=None):
+    # Whether a file is to be rendered from a memory map
+    try:
+        file_stat = entry.stat() if entry is not None else os.stat(file_path)
+    except OSError:
+        return False
+    return file_stat.st_size >= MMAP_THRESHOLD
 
-        content = _apply_rules(file_path, content, rules)
 
+def _mapped_text(buf):
+    """
+    Yield the text of a mapped file in blocks of whole lines, decoded as UTF-8
+    ignoring the errors and with universal newlines: the blocks join to the same
+    text `readlines()` gives for the file.
+    """
+    view = memoryview(buf)
+    size = len(buf)
+    start = 0
+    try:
+        while start < size:
+            # Blocks end after a "\n", a character or a "\r\n" is never split
+            end = buf.rfind(b"\n", start, start + _MMAP_BLOCK) + 1
+            if end <= start:
+                end = buf.find(b"\n", start + _MMAP_BLOCK) + 1 or size
+            text = str(view[start:end], "utf-8", "ignore")
+            if "\r" in text:
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+            start = end
+            yield text
+    finally:
+        view.release()
+
+
+def _join_lines(lines, size=_MMAP_BLOCK):
+    # Joins lines into strings of about `size` characters
+    block = []
+    length = 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= size:
+            yield "".join(block)
+            block = []
+            length = 0
+    if block:
+        yield "".join(block)
+
+
+def _render_mapped(file_path, rules, entry=None, signatures=None, sampling=None):
+    """
+    Render a file as `render_file()` does, reading it through a memory map.
+
+    The chunk of a text file is an iterator of strings: the file is decoded and
+    the rules are applied a block at a time while the chunk is consumed, so only
+    a block of the file is in memory at any time. Files that cannot be mapped,
+    UTF-16 ones and the ones to sample are rendered by `render_file()`.
+
+    Returns:
+        A `(chunk, binary)` tuple, like `render_file()`.
+    """
+    file_path = Path(file_path)
+    if _has_binary_ext(file_path) or _sample_limits(file_path, entry, sampling):
+        return render_file(file_path, rules, entry, signatures, sampling)
+
+    try:
+        with open(file_path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return render_file(file_path, rules, entry, signatures)
+
+    kind, _, signature_type = _classify(buf, file_path, signatures)
+    if kind == "utf-16":
+        buf.close()
+        return render_file(file_path, rules, entry, signatures)
+    if kind == "binary":
+        buf.close()
+        return _binary_chunk(file_path, entry, signature_type), True
+
+    logging.info(f"Processing file: {file_path}")
+    return _mapped_chunk(file_path, buf, rules), False
+
+
+def _mapped_chunk(file_path, buf, rules):
+    # The chunk of a mapped text file, closing the map once consumed
+    blocks = _mapped_text(buf)
+    try:
         ext = _ext2markdown(file_path)
-        markdown_content.append(("-" * 40) + "\n\n")
-        markdown_content.append(f"## FILE: `{file_path}`\n\n")
-        markdown_content.append("```%s\n" % ext)
-        if ext == "markdown":
-            content = content.replace("```", "'''")
+        yield "".join(
+            [("-" * 40) + "\n\n", f"## FILE: `{file_path}`\n\n", "```%s\n" % ext]
+        )
 
-        markdown_content.append(content)
-        markdown_content.append("```\n\n")
+        content = blocks
+        name = os.path.normcase(os.fspath(file_path))
+        if any(rule[1].match(name) for rule in rules):
+            lines = (line for block in blocks for line in io.StringIO(block))
+            content = _join_lines(_stream_rules(file_path, lines, rules))
+
+        for block in content:
+            yield block.replace("```", "'''") if ext == "markdown" else block
+        yield "```\n\n"
+    finally:
+        # The views of the map must be released before it is closed
+        blocks.close()
+        buf.close()
+
+
+def _record_file(file_path, binary):
+    # Records a rendered file, in walk order
+    _files_included.append(file_path)
+    if binary:
+        _files_binaries.append(Path(file_path))
+
+
+# Rulesets compiled by a rendering process, by key, as (rules, signatures,
+# sampling)
+_worker_rules = {}
+
+
+def _init_render_worker(binaries, text_exts, binary_detection, rules, log):
+    global _binary_detection
+
+    # With the fork start method `binaries` may be `_binaries` itself
+    binaries = set(binaries)
+    _binaries.clear()
+    _binaries.update(binaries)
+    text_exts = set(text_exts)
+    _text_exts.clear()
+    _text_exts.update(text_exts)
+    _binary_detection = binary_detection
+    _worker_rules[0] = (
+        _compile_rules(rules),
+        _compile_signatures(rules),
+        _compile_sampling(rules),
+    )
+    if log:
+        _init_logging()
+
+
+def _render_one(
+    file_path, rules, entry=None, digest=False, signatures=None, sampling=None
+):
+    """
+    Render a file as `render_file()` does, returning also the digest of its
+    content if `digest` is True (and the file is not a binary or sampled one).
+    """
+    # The digest is computed on the very bytes the chunk is rendered from
+    chunk, binary, data = _render(file_path, rules, entry, signatures, sampling)
+    if digest and data is not None:
+        return chunk, binary, content_digest(data)
+    return chunk, binary, None
+
+
+def _render_batch(key, rules, file_paths, digest=False):
+    # `rules` is only sent with the batch if the key is not the base ruleset one
+    compiled = _worker_rules.get(key)
+    if compiled is None:
+        compiled = _worker_rules[key] = (
+            _compile_rules(rules),
+            _compile_signatures(rules),
+            _compile_sampling(rules),
+        )
+    rules, signatures, sampling = compiled
+    return [
+        _render_one(file_path, rules, None, digest, signatures, sampling)
+        for file_path in file_paths
+    ]
+
+
+def _ruleset_hash(rules):
+    """
+    Hash everything the chunk of a file depends on, besides the file itself.
+    """
+    settings = [
+        VERSION,
+        sorted(_binaries),
+        sorted(_text_exts),
+        _binary_detection,
+        rules,
+    ]
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def render_files(
+    files, base_rules, processes=1, batch_size=32, cache=None, stream=False
+):
+    """
+    Render files as Markdown chunks.
+
+    With `processes` > 1 the files are rendered by a pool of processes, in
+    batches of consecutive files sharing the same rules: `base_rules` are sent to
+    every process once, when it starts, any other ruleset is sent along with its
+    batches and compiled once per process. The chunks are yielded in the order of
+    `files` anyway, and only a bounded number of batches is pending at any time.
+
+    With a `cache`, the files still matching their cached chunk are not rendered
+    at all and the new chunks are stored in the cache.
+
+    With `stream`, the files of at least `MMAP_THRESHOLD` bytes are rendered by
+    `_render_mapped()` in this process, and are not cached: the chunk of a text
+    file is then an iterator of strings, to be consumed before the next file.
+
+    Args:
+        files (iterable): `(file_path, entry, rules)` tuples, as yielded by
+            `walk_directory()`.
+        base_rules (list): The rules most of the files use.
+        processes (int): Number of rendering processes.
+        batch_size (int): Maximum number of files sent to a process at once.
+        cache (RenderCache): The cache of the rendered files, if any.
+        stream (bool): Render the large files from a memory map, as they are
+            written.
+
+    Yields:
+        `(file_path, chunk, binary)` tuples, see `render_file()`.
+    """
+    # Rulesets are lists shared by all the files in their scope
+    keys = {id(base_rules): (0, base_rules)}
+    hashes = {}
+    compiled = {}
+
+    def compile_ruleset(rules):
+        # Returns the compiled rules, signatures and sampling settings, the
+        # rules are kept as long as their id is used as key
+        key = id(rules)
+        if key not in compiled:
+            compiled[key] = (
+                _compile_rules(rules),
+                _compile_signatures(rules),
+                _compile_sampling(rules),
+                rules,
+            )
+        return compiled[key][:3]
+
+    def render_mapped(file_path, entry, rules):
+        compiled_rules, signatures, sampling = compile_ruleset(rules)
+        return _render_mapped(
+            file_path, compiled_rules, entry, signatures, sampling
+        )
+
+    def lookup(file_path, entry, rules):
+        # Returns the cached (chunk, binary) of the file, if any, and what is
+        # needed to store its new chunk
+        if cache is None:
+            return None, None
+        try:
+            checked_ns = now_ns()
+            stat = entry.stat() if entry is not None else os.stat(file_path)
+        except OSError:
+            return None, None
+        ruleset = hashes.get(id(rules))
+        if ruleset is None:
+            ruleset = hashes[id(rules)] = (_ruleset_hash(rules), rules)
+        path = os.path.abspath(file_path)
+        hit = cache.get(path, file_path, stat, ruleset[0])
+        return hit, (path, file_path, stat, checked_ns, ruleset[0])
+
+    def store(info, chunk, binary, digest):
+        if info is not None:
+            path, name, stat, checked_ns, ruleset = info
+            cache.put(path, name, stat, checked_ns, digest, ruleset, chunk, binary)
+
+    if processes is None or processes <= 1:
+        for file_path, entry, rules in files:
+            if stream and _is_large(file_path, entry):
+                yield (file_path,) + render_mapped(file_path, entry, rules)
+                continue
+
+            hit, info = lookup(file_path, entry, rules)
+            if hit is not None:
+                yield (file_path,) + hit
+                continue
+
+            compiled_rules, signatures, sampling = compile_ruleset(rules)
+            chunk, binary, digest = _render_one(
+                file_path,
+                compiled_rules,
+                entry,
+                info is not None,
+                signatures,
+                sampling,
+            )
+            store(info, chunk, binary, digest)
+            yield file_path, chunk, binary
+        return
+
+    # Items are (file paths and cache infos, future or cached results)
+    pending = collections.deque()
+    batch = []
+    batch_rules = None
+
+    log = logging.getLogger().isEnabledFor(logging.INFO)
+    with concurrent.futures.ProcessPoolExecutor(
+        processes,
+        initializer=_init_render_worker,
+        initargs=(_binaries, _text_exts, _binary_detection, base_rules, log),
+    ) as executor:
+
+        def submit():
+            key = keys.setdefault(id(batch_rules), (len(keys), batch_rules))[0]
+            rules = batch_rules if key else None
+            file_paths = [file_path for file_path, _ in batch]
+            future = executor.submit(
+                _render_batch, key, rules, file_paths, cache is not None
+            )
+            pending.append((list(batch), future))
+            batch.clear()
+
+        def completed():
+            items, results = pending.popleft()
+            if not isinstance(results, list):
+                results = results.result()
+            for (file_path, info), (chunk, binary, digest) in zip(items, results):
+                store(info, chunk, binary, digest)
+                yield file_path, chunk, binary
+
+        for file_path, entry, rules in files:
+            if stream and _is_large(file_path, entry):
+                if batch:
+                    submit()
+                result = render_mapped(file_path, entry, rules) + (None,)
+                pending.append(([(file_path, None)], [result]))
+                if len(pending) > processes * 4:
+                    yield from completed()
+                continue
+
+            hit, info = lookup(file_path, entry, rules)
+            if batch and (
+                hit is not None
+                or rules is not batch_rules
+                or len(batch) >= batch_size
+            ):
+                submit()
+            if hit is not None:
+                pending.append(([(file_path, None)], [hit + (None,)]))
+            else:
+                batch.append((file_path, info))
+                batch_rules = rules
+            if len(pending) > processes * 4:
+                yield from completed()
+
+        if batch:
+            submit()
+        while pending:
+            yield from completed()
 
 
 def _extend_unique(target_list, new_items, key_func=None):
@@ -375,76 +1230,1429 @@ def load_maid_conf(directory, patterns, rules):
     if not p:
         return
 
-    if maid_conf_path in _loaded_confs:
-        return
-
-    _loaded_confs[maid_conf_path] = True
-
-    dct = json.loads(open(p, "r").read())
+    # The configuration is parsed once, but applied every time the directory is
+    # entered (eg. when it is reached from more paths)
+    dct = _loaded_confs.get(maid_conf_path)
+    if dct is None:
+        dct = _loaded_confs[maid_conf_path] = json.loads(open(p, "r").read())
     if "patterns" in dct:
         _extend_unique(patterns, dct["patterns"])
     if "rules" in dct:
         _extend_unique(rules, dct["rules"], lambda x: x["name"])
+    if "signatures" in dct:
+        signatures = _parse_signatures(dct["signatures"], p)
+        _extend_unique(rules, signatures, lambda x: x["name"])
+    if "sample_size" in dct or "sampling" in dct:
+        _extend_unique(rules, _parse_sampling(dct, p), lambda x: x["name"])
 
 
-def scan_directory(directory, markdown_content, global_patterns, global_rules):
+def _parse_signatures(signatures, conf_path):
     """
-    Recursively scan a directory and process all files.
+    Turn the `signatures` of a maid.json into entries of the rules list, so that
+    they have the same scope as the rules.
+
+    A signature is given as `{"signature": "hex bytes", "offset": 0, "type":
+    "MIME type"}`, only `signature` is required.
     """
-    import os
-    import logging
+    entries = []
+    for item in signatures:
+        try:
+            signature = bytes.fromhex(item["signature"])
+            offset = int(item.get("offset", 0))
+        except (KeyError, TypeError, ValueError):
+            logging.warning(f"Invalid signature in {conf_path}: {item}")
+            continue
+        if not signature or offset < 0 or offset + len(signature) > SIGNATURE_SIZE:
+            logging.warning(
+                f"Signature not within the first {SIGNATURE_SIZE} bytes in"
+                f" {conf_path}: {item}"
+            )
+            continue
+
+        entries.append(
+            {
+                "name": f"signature {signature.hex()} at {offset}",
+                "signature": signature.hex(),
+                "offset": offset,
+                "type": item.get("type", "application/octet-stream"),
+            }
+        )
+    return entries
 
-    # Copy global patterns and rules to local variables
-    patterns = global_patterns.copy()
-    rules = global_rules.copy()
 
-    # Load local configuration
+def _parse_sampling(dct, conf_path):
+    """
+    Turn the `sample_size` and `sampling` settings of a maid.json into entries
+    of the rules list, so that they have the same scope as the rules.
+
+    `sample_size` applies to all the files, `sampling` is a list of `{"pattern":
+    "*.sql", "sample_size": "1M", "head": 100, "tail": 20}` settings, only
+    `pattern` and `sample_size` are required. Sizes are in bytes, or with a K,
+    M or G suffix. The lines kept default to `--sample-head` and `--sample-tail`.
+    """
+    items = list(dct.get("sampling", []))
+    if "sample_size" in dct:
+        items.insert(0, {"pattern": "*", "sample_size": dct["sample_size"]})
+
+    entries = []
+    for item in items:
+        try:
+            pattern = item["pattern"]
+            sample_size = _parse_size(item["sample_size"])
+            head = int(item.get("head", _sample_head))
+            tail = int(item.get("tail", _sample_tail))
+        except (KeyError, TypeError, ValueError):
+            logging.warning(f"Invalid sampling setting in {conf_path}: {item}")
+            continue
+        if head < 0 or tail < 0:
+            logging.warning(f"Invalid sampling setting in {conf_path}: {item}")
+            continue
+
+        entries.append(
+            {
+                "name": f"sampling {pattern} in {conf_path}",
+                "pattern": pattern,
+                "sample_size": sample_size,
+                "head": head,
+                "tail": tail,
+            }
+        )
+    return entries
+
+
+def _enter_directory(directory, patterns, rules, parent_matcher=None):
+    """
+    Get the patterns, rules and matcher in scope for a directory.
+
+    The patterns and rules of the local maid.json, if any, are added to the ones
+    of the parent directory and a matcher for the directory is derived from the
+    parent directory one (or from the global `matcher` for the top directory).
+
+    Returns:
+        A `(patterns, rules, scope)` tuple.
+    """
+    parent_patterns = patterns
+    parent_rules = rules
+    patterns = patterns.copy()
+    rules = rules.copy()
+
+    # Load local configuration, the parent rules are kept if nothing is added so
+    # that all the files in the same scope share the same list
     load_maid_conf(directory, patterns, rules)
-    matcher.clear_patterns()
-    matcher.add_patterns(PATTERNS)
-    matcher.add_patterns(patterns)
+    if len(rules) == len(parent_rules):
+        rules = parent_rules
+    if parent_matcher is None:
+        scope = matcher.child(patterns)
+    elif len(patterns) > len(parent_patterns):
+        scope = parent_matcher.child(patterns[len(parent_patterns) :])
+    else:
+        scope = parent_matcher
+
+    return patterns, rules, scope
+
+
+def _list_directory(
+    directory,
+    patterns,
+    rules,
+    parent_matcher=None,
+    ignored=None,
+    follow_symlinks=True,
+):
+    """
+    Read a directory and tell which of its entries are ignored.
+
+    See `_enter_directory()` for the scope of the directory. If `ignored` is set,
+    `directory` is (or is below) that ignored directory and only the paths
+    re-included by an exclusion pattern are kept. Without `follow_symlinks` the
+    symbolic links are left out.
+
+    Returns:
+        A `(patterns, rules, scope, files, subdirs)` tuple, where `files` and
+        `subdirs` are lists of `(entry, is_ignored)` tuples in `os.scandir()`
+        order, or None if the directory cannot be read.
+    """
+    patterns, rules, scope = _enter_directory(
+        directory, patterns, rules, parent_matcher
+    )
 
     logging.info(f"Scanning directory: {directory}")
 
     try:
-        entries = os.listdir(directory)
+        with os.scandir(directory) as it:
+            entries = list(it)
     except PermissionError:
         logging.warning(f"Permission denied: {directory}")
-        return
+        return None
 
     files = []
     subdirs = []
 
-    # Separate files and directories
+    # Separate files and directories, using the file type cached by scandir()
     for entry in entries:
-        full_path = os.path.join(directory, entry)
-        if os.path.isfile(full_path):
-            files.append(entry)
-        elif os.path.isdir(full_path):
-            subdirs.append(entry)
-
-    # Process files in the current directory
-    for file in files:
-        file_path = os.path.join(directory, file)
-        if not matcher.matches(file_path):
-            process_file(file_path, markdown_content, rules)
+        try:
+            if not follow_symlinks and entry.is_symlink():
+                logging.info(f"Skipped symlink: {entry.path}")
+            elif entry.is_file():
+                files.append(entry)
+            elif entry.is_dir():
+                subdirs.append(entry)
+        except OSError:
+            pass
+
+    if ignored is None:
+        files_ignored = scope.matches_in(directory, [e.name for e in files])
+        subdirs_ignored = scope.matches_in(directory, [e.name for e in subdirs])
+    else:
+        files_ignored = [not scope.is_reincluded(e.path, ignored) for e in files]
+        subdirs_ignored = [not scope.is_reincluded(e.path, ignored) for e in subdirs]
+
+    return (
+        patterns,
+        rules,
+        scope,
+        list(zip(files, files_ignored)),
+        list(zip(subdirs, subdirs_ignored)),
+    )
+
+
+def _dir_key(entry):
+    """
+    Return the `(st_dev, st_ino)` key of a directory entry (or path), following
+    symbolic links, or None if it cannot be read.
+    """
+    try:
+        st = entry.stat() if isinstance(entry, os.DirEntry) else os.stat(entry)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def _file_key(entry, dev):
+    # The inode of a DirEntry is known without a stat call, and a file that is
+    # not a symbolic link is on the device of its directory
+    try:
+        if entry.is_symlink():
+            st = entry.stat()
+            return st.st_dev, st.st_ino
+        return dev, entry.inode()
+    except OSError:
+        return None
+
+
+def _in_chain(key, chain):
+    # Whether `key` is in a `(key, parent chain)` linked list
+    while chain is not None:
+        if chain[0] == key:
+            return True
+        chain = chain[1]
+    return False
+
+
+def _walk_step(task, follow_symlinks=True):
+    """
+    List the directory of a walk task.
+
+    A task is a `(directory, patterns, rules, parent matcher, ignored root, depth,
+    prune, chain)` tuple. Ignored directories get a task too, so that they are
+    reported in walk order, with `prune` set if there is nothing to look for
+    inside them. `chain` is the `(key, parent chain)` linked list of the
+    `(st_dev, st_ino)` keys of the directory and its ancestors, see `_dir_key()`.
+
+    Returns:
+        A `(rules, files, tasks)` tuple, with the rules in scope for the files of
+        the directory, the `(entry, is_ignored)` files and the tasks of the
+        subdirectories, or None if the directory cannot be read.
+    """
+    directory, patterns, rules, parent_matcher, ignored, depth, _, chain = task
+
+    if ignored is not None:
+        logging.info(f"Looking for re-included paths in: {directory}")
+    listing = _list_directory(
+        directory, patterns, rules, parent_matcher, ignored, follow_symlinks
+    )
+    if listing is None:
+        return None
+    patterns, rules, scope, files, subdirs = listing
+
+    tasks = []
+    for entry, is_ignored in subdirs:
+        subdir_path = entry.path
+        if not is_ignored:
+            subdir_chain = (_dir_key(entry), chain)
+            tasks.append(
+                (
+                    subdir_path,
+                    patterns,
+                    rules,
+                    scope,
+                    None,
+                    depth + 1,
+                    False,
+                    subdir_chain,
+                )
+            )
+            continue
+
+        # Only descend in ignored directories if an exclusion pattern names a
+        # path below them
+        ignored_root = subdir_path if ignored is None else ignored
+        prune = not scope.may_reinclude(subdir_path, ignored_root)
+        subdir_chain = (None if prune else _dir_key(entry), chain)
+        tasks.append(
+            (
+                subdir_path,
+                patterns,
+                rules,
+                scope,
+                ignored_root,
+                depth + 1,
+                prune,
+                subdir_chain,
+            )
+        )
+
+    return rules, files, tasks
+
+
+def walk_directory(
+    directory,
+    global_patterns,
+    global_rules,
+    order="dfs",
+    max_depth=None,
+    jobs=1,
+    directories=None,
+    follow_symlinks=True,
+    seen=None,
+    should_stop=None,
+):
+    """
+    Walk a directory tree and yield all the files to process.
+
+    The walk uses an explicit stack (`order="dfs"`, the files of a directory come
+    before the ones of its subdirectories, like a recursive scan) or queue
+    (`order="bfs"`, level by level), so deep trees do not hit the recursion limit.
+
+    With `jobs` > 1 a pool of threads lists the next directories of the walk
+    ahead of it, at most `jobs * 4` at a time so that the listings waiting to be
+    consumed stay bounded. Every task carries its own patterns, rules and
+    matcher, and the results are still consumed in walk order, so the files come
+    in the same order.
+
+    Directories and files are told apart by their `(st_dev, st_ino)`: a directory
+    or file reached again (through a symbolic link, a hard link or a bind mount)
+    is skipped, so symbolic link loops do not make the walk run away and the
+    same subtree is read once.
+
+    Args:
+        directory (str): The directory to walk.
+        global_patterns (list): Ignoring patterns, extended by every maid.json found.
+        global_rules (list): Rules, extended by every maid.json found.
+        order (str): "dfs" for depth-first or "bfs" for breadth-first order.
+        max_depth (int): Do not descend more than `max_depth` levels below
+            `directory` (0 only walks the files of `directory`). None for no limit.
+        jobs (int): Number of threads listing the directories.
+        directories (list): If given, every directory listed is appended to it.
+        follow_symlinks (bool): Follow the symbolic links to files and
+            directories, otherwise they are skipped.
+        seen (dict): The `(st_dev, st_ino)` keys of the directories and files
+            already walked, with their paths. Updated by the walk, it can be
+            shared by more walks.
+        should_stop (callable): Called with every directory before it is
+            entered, the walk stops as soon as it returns True.
+
+    Yields:
+        `(file_path, entry, rules)` tuples, `rules` being the ones in scope for
+        the file.
+    """
+    executor = None
+    # Listings submitted to the pool and not consumed yet
+    outstanding = 0
+
+    def is_walked(task):
+        return not task[6] and (max_depth is None or task[5] <= max_depth)
+
+    def expand(task):
+        if stop.is_set():
+            return None
+        return _walk_step(task, follow_symlinks)
+
+    def prefetch():
+        # Submits the listing of the next directories of the walk, in walk
+        # order, as long as there are free slots. Loops are never listed ahead,
+        # the walk skips them.
+        nonlocal outstanding
+        upcoming = reversed(pending) if order == "dfs" else iter(pending)
+        for item in itertools.islice(upcoming, lookahead):
+            if outstanding >= lookahead:
+                break
+            task, future = item
+            if future is not None or not is_walked(task):
+                continue
+            chain = task[7]
+            if chain[0] is None or _in_chain(chain[0], chain[1]):
+                continue
+            item[1] = executor.submit(expand, task)
+            outstanding += 1
+
+    if jobs and jobs > 1:
+        executor = concurrent.futures.ThreadPoolExecutor(jobs)
+        lookahead = jobs * 4
+    stop = threading.Event()
+
+    if seen is None:
+        seen = {}
+    root_chain = (_dir_key(directory), None)
+    root = (directory, global_patterns, global_rules, None, None, 0, False, root_chain)
+    # Items are [task, future listing it or None]
+    pending = collections.deque([[root, None]])
+    pop = pending.pop if order == "dfs" else pending.popleft
+
+    try:
+        while pending:
+            if executor is not None:
+                prefetch()
+            task, future = pop()
+            if future is not None:
+                outstanding -= 1
+            directory, _, _, _, ignored, depth, prune, chain = task
+            if should_stop is not None and should_stop(directory):
+                logging.info(f"Walk stopped at: {directory}")
+                return
+
+            if ignored == directory:
+                _files_excluded.append(directory)
+
+            if prune:
+                logging.info(f"Skipped ignored directory: {directory}")
+                continue
+
+            if not is_walked(task):
+                logging.info(f"Skipped directory beyond max depth: {directory}")
+                continue
+
+            key = chain[0]
+            if key in seen:
+                if _in_chain(key, chain[1]):
+                    logging.info(f"Skipped symlink loop: {directory} -> {seen[key]}")
+                else:
+                    logging.info(
+                        f"Skipped duplicate directory: {directory}"
+                        f" (same as {seen[key]})"
+                    )
+                continue
+            if key is not None:
+                seen[key] = directory
+
+            step = expand(task) if future is None else future.result()
+            if step is None:
+                continue
+            rules, files, tasks = step
+            if directories is not None:
+                directories.append(directory)
+
+            dev = None if key is None else key[0]
+            for entry, is_ignored in files:
+                if not is_ignored:
+                    file_key = None if dev is None else _file_key(entry, dev)
+                    if file_key in seen:
+                        logging.info(
+                            f"Skipped duplicate file: {entry.path}"
+                            f" (same as {seen[file_key]})"
+                        )
+                        continue
+                    if file_key is not None:
+                        seen[file_key] = entry.path
+                    yield entry.path, entry, rules
+                elif ignored is None:
+                    _files_excluded.append(entry.path)
+                    logging.info(f"Skipped ignored file: {entry.path}")
+
+            # The stack pops the last task first
+            tasks = reversed(tasks) if order == "dfs" else tasks
+            pending.extend([subtask, None] for subtask in tasks)
+    finally:
+        # Pending listings return at once, nothing more is scheduled
+        stop.set()
+        if executor is not None:
+            executor.shutdown()
+
+
+class _StatEntry:
+    """
+    The stat info of a file, taken in place of an os.DirEntry when the file was
+    not found by a walk: its `stat()` and `inode()` are answered without
+    querying the file system again.
+    """
+
+    __slots__ = ("path", "_stat")
+
+    def __init__(self, path, file_stat):
+        self.path = path
+        self._stat = file_stat
+
+    def stat(self):
+        return self._stat
+
+    def inode(self):
+        return self._stat.st_ino
+
+
+class _ScopeResolver:
+    """
+    Give the files of a list below a directory the scope a walk of the directory
+    would give them, without walking it.
+
+    Every directory between `directory` and a file gets the same scope it gets
+    in `walk_directory()`: its maid.json is loaded (once, when the first file
+    below it is resolved) and the files below an ignored directory are skipped,
+    unless an exclusion pattern re-includes them.
+
+    Like a walk, the files already seen (by their `(st_dev, st_ino)`) are skipped
+    and, without `follow_symlinks`, so are the symbolic links. If `should_stop`
+    returns True for a file, it and the files after it are not resolved.
+    """
+
+    def __init__(
+        self,
+        directory,
+        global_patterns,
+        global_rules,
+        max_depth=None,
+        directories=None,
+        follow_symlinks=True,
+        seen=None,
+        should_stop=None,
+    ):
+        self.max_depth = max_depth
+        self.directories = directories
+        self.follow_symlinks = follow_symlinks
+        self.seen = {} if seen is None else seen
+        self.should_stop = should_stop
+        # Relative directory -> (path, patterns, rules, scope, ignored root,
+        # depth), or None if the files below it are skipped
+        self._states = {}
+        self._enter("", directory, global_patterns, global_rules, None, None, 0)
+
+    def _enter(self, rel_dir, path, patterns, rules, parent_matcher, ignored, depth):
+        state = (path,) + _enter_directory(path, patterns, rules, parent_matcher)
+        self._states[rel_dir] = state + (ignored, depth)
+        if self.directories is not None:
+            self.directories.append(path)
+
+    def _state(self, rel_dir):
+        states = self._states
+
+        # The missing ancestors are entered top down
+        missing = []
+        while rel_dir not in states:
+            missing.append(rel_dir)
+            rel_dir = rel_dir.rpartition("/")[0]
+
+        for rel_dir in reversed(missing):
+            state = states[rel_dir.rpartition("/")[0]]
+            if state is None:
+                states[rel_dir] = None
+                continue
+
+            parent, patterns, rules, scope, ignored, depth = state
+            path = os.path.join(parent, rel_dir.rpartition("/")[2])
+            if ignored is None:
+                is_ignored = scope.matches(path)
+            else:
+                is_ignored = not scope.is_reincluded(path, ignored)
+
+            if self.max_depth is not None and depth >= self.max_depth:
+                logging.info(f"Skipped directory beyond max depth: {path}")
+                states[rel_dir] = None
+            elif not self.follow_symlinks and os.path.islink(path):
+                logging.info(f"Skipped symlink: {path}")
+                states[rel_dir] = None
+            elif not is_ignored:
+                self._enter(rel_dir, path, patterns, rules, scope, None, depth + 1)
+            else:
+                if ignored is None:
+                    _files_excluded.append(path)
+
+                # Only look below ignored directories if an exclusion pattern
+                # names a path below them
+                ignored_root = path if ignored is None else ignored
+                if scope.may_reinclude(path, ignored_root):
+                    logging.info(f"Looking for re-included paths in: {path}")
+                    self._enter(
+                        rel_dir, path, patterns, rules, scope, ignored_root, depth + 1
+                    )
+                else:
+                    logging.info(f"Skipped ignored directory: {path}")
+                    states[rel_dir] = None
+
+        return states[rel_dir]
+
+    def resolve(self, names):
+        """
+        Yield `(file_path, entry, rules)` for the names (relative to the directory
+        and using "/") of the files to process, in the same order: `entry` is a
+        `_StatEntry` holding the stat info the file was checked with.
+        """
+        # Consecutive files in the same directory are matched at once
+        for rel_dir, group in itertools.groupby(
+            (name.rpartition("/") for name in names), lambda parts: parts[0]
+        ):
+            group = [parts[2] for parts in group]
+            if self.should_stop is not None:
+                root = self._states[""][0]
+                first = os.path.join(root, rel_dir, group[0])
+                if self.should_stop(first):
+                    logging.info(f"Walk stopped at: {first}")
+                    return
+
+            state = self._state(rel_dir)
+            if state is None:
+                continue
+
+            parent, _, rules, scope, ignored, _ = state
+            if ignored is None:
+                group_ignored = scope.matches_in(parent, group)
+            else:
+                group_ignored = [
+                    not scope.is_reincluded(os.path.join(parent, name), ignored)
+                    for name in group
+                ]
+
+            for name, name_ignored in zip(group, group_ignored):
+                file_path = os.path.join(parent, name)
+                if name_ignored:
+                    if ignored is None:
+                        _files_excluded.append(file_path)
+                        logging.info(f"Skipped ignored file: {file_path}")
+                else:
+                    yield from self._checked(file_path, rules)
+
+    def _checked(self, file_path, rules):
+        # Yields the file if it is a regular file not seen yet
+        try:
+            if self.follow_symlinks:
+                st = os.stat(file_path)
+            else:
+                st = os.lstat(file_path)
+        except OSError:
+            logging.warning(f"File not found: {file_path}")
+            return
+
+        key = (st.st_dev, st.st_ino)
+        if stat.S_ISDIR(st.st_mode):
+            logging.info(f"Skipped directory: {file_path}")
+        elif stat.S_ISLNK(st.st_mode):
+            logging.info(f"Skipped symlink: {file_path}")
+        elif not stat.S_ISREG(st.st_mode):
+            logging.warning(f"File not found: {file_path}")
+        elif key in self.seen:
+            logging.info(
+                f"Skipped duplicate file: {file_path} (same as {self.seen[key]})"
+            )
         else:
-            _files_excluded.append(file_path)
-            logging.info(f"Skipped ignored file: {file_path}")
-
-    # Recursively process subdirectories
-    for subdir in subdirs:
-        subdir_path = os.path.join(directory, subdir)
-        if not matcher.matches(subdir_path):
-            scan_directory(subdir_path, markdown_content, patterns, rules)
+            self.seen[key] = file_path
+            yield file_path, _StatEntry(file_path, st), rules
+
+
+def resolve_files(
+    directory,
+    names,
+    global_patterns,
+    global_rules,
+    max_depth=None,
+    directories=None,
+    follow_symlinks=True,
+    seen=None,
+    should_stop=None,
+):
+    """
+    Yield the files of a list that a walk of `directory` would process, without
+    walking it.
+
+    Args:
+        directory (str): The directory the names are relative to.
+        names (iterable): File names relative to `directory`, using "/".
+        global_patterns (list): Ignoring patterns, extended by every maid.json found.
+        global_rules (list): Rules, extended by every maid.json found.
+        max_depth (int): Skip the files more than `max_depth` levels below
+            `directory`. None for no limit.
+        directories (list): If given, every directory entered is appended to it.
+        follow_symlinks (bool): See `walk_directory()`.
+        seen (dict): See `walk_directory()`.
+        should_stop (callable): Called with a file before resolving it and the
+            files after it in the same directory, the walk stops as soon as it
+            returns True.
+
+    Yields:
+        `(file_path, entry, rules)` tuples, like `walk_directory()`, `entry`
+        being a `_StatEntry`.
+    """
+    resolver = _ScopeResolver(
+        directory,
+        global_patterns,
+        global_rules,
+        max_depth,
+        directories,
+        follow_symlinks,
+        seen,
+        should_stop,
+    )
+    yield from resolver.resolve(names)
+
+
+def walk_git_index(
+    directory,
+    global_patterns,
+    global_rules,
+    max_depth=None,
+    directories=None,
+    follow_symlinks=True,
+    seen=None,
+    order="dfs",
+    jobs=1,
+    should_stop=None,
+):
+    """
+    Yield the files tracked by git below `directory`, as `walk_directory()` would
+    if they were the only files in the work tree.
+
+    The file names come from the git index, no directory is read and git itself
+    is not needed. See `resolve_files()` for the arguments. If the index cannot
+    be read (eg. a split index), `directory` is walked instead, see
+    `walk_directory()` for `order` and `jobs`.
+    """
+    repository = find_repository(directory)
+    if repository is None:
+        logging.warning(f"Not in a git work tree: {directory}")
+        return
+
+    work_tree, git_dir = repository
+    try:
+        names = tracked_files(work_tree, git_dir)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Cannot read the git index, walking {directory}: {e}")
+        yield from walk_directory(
+            directory,
+            global_patterns,
+            global_rules,
+            order,
+            max_depth,
+            jobs,
+            directories,
+            follow_symlinks,
+            seen,
+            should_stop,
+        )
+        return
+    prefix = os.path.relpath(os.path.abspath(directory), work_tree)
+    if prefix != os.curdir:
+        prefix = prefix.replace(os.sep, "/") + "/"
+        names = [name[len(prefix) :] for name in names if name.startswith(prefix)]
+
+    logging.info(f"Found {len(names)} tracked files in: {directory}")
+
+    yield from resolve_files(
+        directory,
+        names,
+        global_patterns,
+        global_rules,
+        max_depth,
+        directories,
+        follow_symlinks,
+        seen,
+        should_stop,
+    )
+
+
+def read_file_list(source):
+    """
+    Read a list of paths from a file, or from stdin if `source` is "-".
+
+    The paths are separated by NULs if there is any NUL in the list (as written
+    by `find -print0`, `fd -0` or `git ls-files -z`), by newlines otherwise.
+    """
+    if source == "-":
+        data = sys.stdin.buffer.read()
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+
+    if b"\0" in data:
+        paths = data.split(b"\0")
+    else:
+        paths = [path.rstrip(b"\r") for path in data.split(b"\n")]
+
+    return [os.fsdecode(path) for path in paths if path]
+
+
+def walk_file_list(
+    file_paths,
+    global_patterns,
+    global_rules,
+    max_depth=None,
+    directories=None,
+    follow_symlinks=True,
+    seen=None,
+    roots=(),
+    from_cwd=True,
+    should_stop=None,
+):
+    """
+    Yield the files of a list, as a walk would if they were the only files.
+
+    With `from_cwd`, paths below the current directory (relative or absolute)
+    are resolved from it, like a walk of ".". The other paths are resolved from the nearest of
+    `roots` they are below, like a walk of that directory, or else from their
+    own directory: the directories above are never matched against the patterns
+    and their maid.json files are not loaded. Patterns and rules apply to all
+    the files, and they are yielded in the order of the list.
+
+    Args:
+        file_paths (iterable): The paths of the files.
+        global_patterns (list): Ignoring patterns, extended by every maid.json found.
+        global_rules (list): Rules, extended by every maid.json found.
+        max_depth (int): Skip the files more than `max_depth` levels below the
+            directory they are resolved from. None for no limit.
+        directories (list): If given, every directory entered is appended to it.
+        follow_symlinks (bool): See `walk_directory()`.
+        seen (dict): See `walk_directory()`.
+        roots (iterable): The directories walked along with the list.
+        from_cwd (bool): Resolve the paths below the current directory from it.
+        should_stop (callable): See `resolve_files()`.
+
+    Yields:
+        `(file_path, entry, rules)` tuples, like `walk_directory()`, `entry`
+        being a `_StatEntry`.
+    """
+    resolvers = {}
+    if seen is None:
+        seen = {}
+    # The deepest roots first
+    roots = sorted(
+        ((os.path.abspath(root), root) for root in roots),
+        key=lambda item: len(item[0]),
+        reverse=True,
+    )
+
+    cwd = os.path.join(os.getcwd(), "")
+
+    def split(file_path):
+        # Returns the directory to resolve the path from and the name
+        file_path = os.path.normpath(file_path)
+        abs_path = os.path.abspath(file_path)
+        if from_cwd and abs_path.startswith(cwd):
+            return os.curdir, abs_path[len(cwd) :].replace(os.sep, "/")
+
+        for abs_root, root in roots:
+            if abs_path.startswith(os.path.join(abs_root, "")):
+                name = os.path.relpath(abs_path, abs_root)
+                return root, name.replace(os.sep, "/")
+        root, name = os.path.split(file_path)
+        return root, name
+
+    # Paths listed more times (maybe in different ways) are processed once
+    names = dict.fromkeys(split(file_path) for file_path in file_paths)
+    for root, group in itertools.groupby(names, lambda item: item[0]):
+        if root not in resolvers:
+            resolvers[root] = _ScopeResolver(
+                root,
+                global_patterns,
+                global_rules,
+                max_depth,
+                directories,
+                follow_symlinks,
+                seen,
+                should_stop,
+            )
+        yield from resolvers[root].resolve(name for _, name in group)
+
+
+def walk_paths(
+    paths,
+    patterns,
+    rules,
+    order="dfs",
+    max_depth=None,
+    jobs=1,
+    directories=None,
+    git_tracked=False,
+    follow_symlinks=True,
+    seen=None,
+    should_stop=None,
+):
+    """
+    Walk all the directories in `paths`, one after the other.
+
+    See `walk_directory()` for the arguments and the yielded values. With
+    `git_tracked` only the files tracked by git are yielded, in the git index
+    order, see `walk_git_index()`. The directories and files reached from more
+    paths are yielded once.
+    """
+    if seen is None:
+        seen = {}
+    for path in paths:
+        if os.path.isdir(path):
+            logging.info(f"Scanning directory: {path}")
+
+            if git_tracked:
+                yield from walk_git_index(
+                    path,
+                    patterns,
+                    rules,
+                    max_depth,
+                    directories,
+                    follow_symlinks,
+                    seen,
+                    order,
+                    jobs,
+                    should_stop,
+                )
+            else:
+                yield from walk_directory(
+                    path,
+                    patterns,
+                    rules,
+                    order,
+                    max_depth,
+                    jobs,
+                    directories,
+                    follow_symlinks,
+                    seen,
+                    should_stop,
+                )
+
+
+def _skip_file(files, file_stat):
+    """
+    Filter the `(file_path, entry, rules)` tuples of a walk, dropping the file
+    `file_stat` belongs to (ie. the output file, while it is written).
+    """
+    for item in files:
+        file_path, entry, _ = item
+        # The inode of an entry is known without a stat call
+        if entry is None or entry.inode() == file_stat.st_ino:
+            try:
+                st = os.stat(file_path) if entry is None else entry.stat()
+                if os.path.samestat(st, file_stat):
+                    _files_excluded.append(file_path)
+                    logging.info(f"Skipped output file: {file_path}")
+                    continue
+            except OSError:
+                pass
+        yield item
+
+
+def _with_last(iterable):
+    # Yields `(item, last)` pairs, `last` is True for the last item
+    iterator = iter(iterable)
+    for item in iterator:
+        for following in iterator:
+            yield item, False
+            item = following
+        yield item, True
+
+
+class _Budget:
+    """
+    The resource budgets of a run, and what they cut.
+
+    Files larger than `max_file_size` are skipped. When another budget is
+    exhausted the run stops: the walk is not continued and the files left are
+    neither read nor written. Limits set to None are not enforced.
+    """
+
+    # Closes the code fence of a streamed chunk cut by the output budget
+    _FENCE_CLOSE = "```\n\n"
+
+    def __init__(
+        self,
+        max_files=None,
+        max_bytes=None,
+        max_file_size=None,
+        max_output_bytes=None,
+        timeout=None,
+    ):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.max_output_bytes = max_output_bytes
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.files = 0
+        self.bytes = 0
+        self.output_bytes = 0
+        # (option, limit, first file not processed), once the run is stopped
+        self.stopped = None
+        # Whether that file was written in part
+        self.partial = False
+        # (file path, size) of the files over max_file_size
+        self.skipped = []
+
+    def _stop(self, option, limit, file_path):
+        self.stopped = (option, limit, file_path)
+        logging.warning(f"Budget {option} ({limit}) exhausted at: {file_path}")
+
+    def _timed_out(self, file_path):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self._stop("--timeout", f"{self.timeout:g} seconds", file_path)
+            return True
+        return False
+
+    def walk_stopped(self, path):
+        """
+        Tell the walk whether to stop before `path`, a directory or file: the
+        timeout is checked even if the walk finds no file to process.
+        """
+        return self.stopped is not None or self._timed_out(path)
+
+    def files_within(self, files):
+        """
+        Filter the `(file_path, entry, rules)` tuples of a walk, skipping the
+        files too large and stopping when the input budgets are exhausted.
+        """
+        sized = self.max_bytes is not None or self.max_file_size is not None
+        for item in files:
+            file_path, entry, _ = item
+            if self._timed_out(file_path):
+                return
+            if self.max_files is not None and self.files >= self.max_files:
+                self._stop("--max-files", f"{self.max_files} files", file_path)
+                return
+
+            if sized:
+                try:
+                    size = (entry.stat() if entry else os.stat(file_path)).st_size
+                except OSError:
+                    size = 0
+                if self.max_file_size is not None and size > self.max_file_size:
+                    self.skipped.append((file_path, size))
+                    _files_excluded.append(file_path)
+                    logging.info(f"Skipped large file: {file_path} ({size} bytes)")
+                    continue
+                if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+                    self._stop("--max-bytes", f"{self.max_bytes} bytes", file_path)
+                    return
+                self.bytes += size
+
+            self.files += 1
+            yield item
+
+    def write(self, f, file_path, chunk):
+        """
+        Write the chunk of a file, unless the output budgets are exhausted.
+
+        A chunk streamed as an iterator of strings (see `render_files()`) is
+        written up to the piece that would go over the output budget, then its
+        code fence is closed: room for the closing fence is kept in the budget
+        while the pieces before the last one are written.
+
+        Returns:
+            bool: False if the chunk was not written (or only in part) and the
+            run must stop.
+        """
+        if self._timed_out(file_path):
+            return False
+
+        streamed = not isinstance(chunk, str)
+        pieces = _with_last(chunk if streamed else [chunk])
+        written = False
+        for piece, last in pieces:
+            if self.max_output_bytes is not None:
+                size = len(piece.encode("utf-8"))
+                reserved = 0 if last or not streamed else len(self._FENCE_CLOSE)
+                if self.output_bytes + size + reserved > self.max_output_bytes:
+                    limit = f"{self.max_output_bytes} bytes"
+                    self._stop("--max-output-bytes", limit, file_path)
+                    self.partial = written
+                    if streamed:
+                        chunk.close()
+                    if written:
+                        f.write(self._FENCE_CLOSE)
+                        self.output_bytes += len(self._FENCE_CLOSE)
+                    return False
+                self.output_bytes += size
+            f.write(piece)
+            written = True
+        return True
+
+    def summary(self):
+        """Return the Markdown section listing what was cut, "" if nothing was."""
+        if self.stopped is None and not self.skipped:
+            return ""
+
+        lines = ["-" * 40, "", "## Budget summary", ""]
+        if self.stopped is not None:
+            option, limit, file_path = self.stopped
+            if self.partial:
+                lines.append(
+                    f"- `{option}` ({limit}) exhausted: `{file_path}` was cut, the"
+                    " files after it were not processed"
+                )
+            else:
+                lines.append(
+                    f"- `{option}` ({limit}) exhausted: the files from"
+                    f" `{file_path}` on were not processed"
+                )
+        if self.skipped:
+            lines.append(
+                f"- {len(self.skipped)} files larger than `--max-file-size`"
+                f" ({self.max_file_size} bytes) were skipped:"
+            )
+            for file_path, size in self.skipped:
+                lines.append(f"  - `{file_path}` ({size} bytes)")
+        return "\n".join(lines) + "\n"
+
+
+# Seconds without events before the output is updated, in watch mode
+WATCH_DEBOUNCE = 0.2
+
+_WATCH_MASK = (
+    inotify.IN_CLOSE_WRITE
+    | inotify.IN_MODIFY
+    | inotify.IN_ATTRIB
+    | inotify.IN_CREATE
+    | inotify.IN_DELETE
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_MOVED_TO
+    | inotify.IN_DELETE_SELF
+    | inotify.IN_MOVE_SELF
+    | inotify.IN_ONLYDIR
+    | inotify.IN_EXCL_UNLINK
+)
+
+# Events changing the files to walk, rather than the content of a file
+_WATCH_WALK_EVENTS = (
+    inotify.IN_CREATE
+    | inotify.IN_DELETE
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_MOVED_TO
+    | inotify.IN_DELETE_SELF
+    | inotify.IN_MOVE_SELF
+    | inotify.IN_Q_OVERFLOW
+)
+
+# Events adding a path that may already be rendered, replacing its file (eg. a
+# save renaming a temporary file over it) or, for a directory, its files
+_WATCH_NEW_EVENTS = inotify.IN_CREATE | inotify.IN_MOVED_TO
+
+# Events of a git directory replacing its index (git renames index.lock over it)
+_WATCH_INDEX_MASK = inotify.IN_MOVED_TO | inotify.IN_CLOSE_WRITE | inotify.IN_ONLYDIR
+
+
+def _write_atomic(file_path, pieces):
+    # Readers never see a half written file
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for piece in pieces:
+            f.write(piece)
+    os.replace(tmp_path, file_path)
+
+
+def _watch(args, file_list, patterns, rules, cache=None):
+    """
+    Keep the output file up to date, until interrupted.
+
+    The directories walked are watched with inotify. When a file changes only
+    that file is rendered again. When files or directories are created, deleted
+    or moved, or a maid.json changes, the directories are walked again, but only
+    the new files (including the ones created or moved over a file already
+    rendered, and the ones below a directory created or moved in) and the ones
+    whose rules changed are rendered. With `--git-tracked` the git index is
+    watched too: when it changes, the directories are walked again.
+    """
+    output = os.path.abspath(args.output)
+    skipped = (output, output + ".tmp")
+    skipped_names = [os.path.basename(path) for path in skipped]
+    cache_dir = None
+    if cache is not None:
+        cache_dir = os.path.dirname(os.path.abspath(cache.path)) + os.sep
+
+    # file path -> (rules, ruleset hash, chunk, binary), in walk order
+    chunks = {}
+    watches = {}  # watch descriptor -> directory
+    git_dirs = {}  # watch descriptor -> git directory, with --git-tracked
+
+    def is_skipped(file_path):
+        # Only the paths that may be the output or in the cache are compared
+        name = os.path.basename(file_path)
+        if cache_dir is None and name not in skipped_names:
+            return False
+        path = os.path.abspath(file_path)
+        return path in skipped or (cache_dir is not None and path.startswith(cache_dir))
+
+    def render(files):
+        # Renders `(file_path, rules)` tuples, updating `chunks`
+        rendered = render_files(
+            ((file_path, None, rules) for file_path, rules in files),
+            rules,
+            args.processes,
+            cache=cache,
+        )
+        return {file_path: (chunk, binary) for file_path, chunk, binary in rendered}
+
+    def is_dirty(file_path, dirty, dirty_dirs):
+        # Whether the file or a directory above it changed
+        if file_path in dirty:
+            return True
+        if not dirty_dirs:
+            return False
+        parent = os.path.dirname(file_path)
+        while parent not in dirty_dirs:
+            if os.path.dirname(parent) == parent:
+                return False
+            parent = os.path.dirname(parent)
+        return True
+
+    def walk(dirty, dirty_dirs=()):
+        nonlocal chunks
+
+        _loaded_confs.clear()
+        _files_included.clear()
+        _files_excluded.clear()
+        _files_binaries.clear()
+
+        directories = []
+        files = _walk_sources(args, file_list, patterns, rules, directories)
+        files = [
+            (file_path, file_rules)
+            for file_path, _, file_rules in files
+            if not is_skipped(file_path)
+        ]
+
+        hashes = {}
+        for _, file_rules in files:
+            if id(file_rules) not in hashes:
+                hashes[id(file_rules)] = _ruleset_hash(file_rules)
+
+        rendered = render(
+            (file_path, file_rules)
+            for file_path, file_rules in files
+            if file_path not in chunks
+            or is_dirty(file_path, dirty, dirty_dirs)
+            or chunks[file_path][1] != hashes[id(file_rules)]
+        )
+
+        old_chunks = chunks
+        chunks = {}
+        for file_path, file_rules in files:
+            if file_path in rendered:
+                chunk, binary = rendered[file_path]
+            else:
+                chunk, binary = old_chunks[file_path][2:]
+            chunks[file_path] = (file_rules, hashes[id(file_rules)], chunk, binary)
+
+        # Watch the new directories, forget the ones not walked anymore
+        walked = set(directories)
+        for wd, directory in list(watches.items()):
+            if directory not in walked:
+                del watches[wd]
+                try:
+                    notifier.rm_watch(wd)
+                except OSError:
+                    pass
+        for directory in walked.difference(watches.values()):
+            try:
+                watches[notifier.add_watch(directory, _WATCH_MASK)] = directory
+            except OSError as e:
+                logging.warning(f"Cannot watch {directory}: {e}")
+
+        return len(rendered)
+
+    def update(dirty):
+        rendered = render((file_path, chunks[file_path][0]) for file_path in dirty)
+        for file_path, (chunk, binary) in rendered.items():
+            chunks[file_path] = chunks[file_path][:2] + (chunk, binary)
+        return len(rendered)
+
+    def write():
+        _files_included[:] = chunks.keys()
+        _files_binaries[:] = [Path(p) for p, c in chunks.items() if c[3]]
+        _write_atomic(
+            args.output,
+            itertools.chain([_content_header()], (c[2] for c in chunks.values())),
+        )
+        if cache is not None:
+            cache.commit()
+
+    with inotify.Inotify() as notifier:
+        count = walk(set())
+        write()
+
+        if args.git_tracked:
+            for path in args.paths:
+                repository = os.path.isdir(path) and find_repository(path)
+                if not repository or repository[1] in git_dirs.values():
+                    continue
+                try:
+                    wd = notifier.add_watch(repository[1], _WATCH_INDEX_MASK)
+                    git_dirs[wd] = repository[1]
+                except OSError as e:
+                    logging.warning(f"Cannot watch {repository[1]}: {e}")
+        logging.info(f"Watching {len(watches)} directories, {count} files rendered")
+
+        try:
+            while True:
+                events = notifier.read_events()
+                while True:
+                    more = notifier.read_events(WATCH_DEBOUNCE)
+                    if not more:
+                        break
+                    events.extend(more)
+
+                rewalk = False
+                dirty = set()
+                dirty_dirs = set()
+                for wd, mask, _, name in events:
+                    if mask & inotify.IN_Q_OVERFLOW:
+                        rewalk = True
+                        continue
+                    if wd in git_dirs:
+                        if name == "index":
+                            rewalk = True
+                        continue
+                    if wd not in watches:
+                        continue
+                    if mask & inotify.IN_IGNORED:
+                        # The directory is gone, its parent got an event too
+                        del watches[wd]
+                        continue
+
+                    file_path = os.path.join(watches[wd], name) if name else watches[wd]
+                    if is_skipped(file_path):
+                        continue
+                    if mask & _WATCH_WALK_EVENTS or name in ("maid.json", ".maid.json"):
+                        rewalk = True
+                        if mask & _WATCH_NEW_EVENTS:
+                            if mask & inotify.IN_ISDIR:
+                                dirty_dirs.add(file_path)
+                            else:
+                                dirty.add(file_path)
+                    elif file_path in chunks:
+                        dirty.add(file_path)
+
+                if rewalk:
+                    count = walk(dirty, dirty_dirs)
+                elif dirty:
+                    count = update(dirty)
+                else:
+                    continue
+
+                write()
+                logging.info(f"Markdown file updated: {count} files rendered")
+        except KeyboardInterrupt:
+            pass
+
+
+def _walk_sources(
+    args, file_list, patterns, rules, directories=None, should_stop=None
+):
+    # The files of the file list, then the ones of the paths arguments: the
+    # directories are walked, the files are processed as a file list. A file is
+    # processed once, however many times it is reached. See `walk_directory()`
+    # for `should_stop`.
+    seen = {}
+    # The paths out of the current directory are scoped from these
+    roots = [path for path in args.paths if os.path.isdir(path)]
+    if file_list:
+        yield from walk_file_list(
+            file_list,
+            patterns,
+            rules,
+            args.max_depth,
+            directories,
+            args.follow_symlinks,
+            seen,
+            roots,
+            should_stop=should_stop,
+        )
+
+    for is_dir, paths in itertools.groupby(args.paths, os.path.isdir):
+        if is_dir:
+            yield from walk_paths(
+                paths,
+                patterns,
+                rules,
+                args.order,
+                args.max_depth,
+                args.jobs,
+                directories,
+                args.git_tracked,
+                args.follow_symlinks,
+                seen,
+                should_stop,
+            )
         else:
-            _files_excluded.append(subdir_path)
-            logging.info(f"Skipped ignored directory: {subdir_path}")
+            # The files named are scoped from their own directory, unless they
+            # are below a directory named
+            yield from walk_file_list(
+                paths,
+                patterns,
+                rules,
+                args.max_depth,
+                directories,
+                args.follow_symlinks,
+                seen,
+                roots,
+                from_cwd=False,
+                should_stop=should_stop,
+            )
+
+
+def _write_content(args, file_list, patterns, rules, budget, cache=None):
+    # Every file is written as soon as it is rendered, while the directories are
+    # still walked, so only one file at a time is kept in memory
+    with open(args.output, "w", encoding="utf-8") as f:
+        header = _content_header()
+        f.write(header)
+        budget.output_bytes = len(header.encode("utf-8"))
+
+        files = _walk_sources(
+            args, file_list, patterns, rules, should_stop=budget.walk_stopped
+        )
+        files = _skip_file(files, os.fstat(f.fileno()))
+        rendered = render_files(
+            budget.files_within(files),
+            rules,
+            args.processes,
+            cache=cache,
+            stream=True,
+        )
+        try:
+            for file_path, chunk, binary in rendered:
+                if not budget.write(f, file_path, chunk):
+                    break
+                _record_file(file_path, binary)
+        finally:
+            # Stops the walk and the rendering processes
+            rendered.close()
+
+        f.write(budget.summary())
+
+
+def _content_header():
+    return (
+        "# Content\n\nThis file was generated by [Maid](https://github.com/fsoft72/maid) v%s - by [Fabio Rotondo](https://github.com/fsoft72)\n\n"
+        % VERSION
+    )
+
+
+def _init_logging():
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
 
 
 def _maid_init(args):
+    global _binary_detection, _sample_head, _sample_tail
+
     rules = []
     patterns = args.pattern
+    _sample_head = args.sample_head
+    _sample_tail = args.sample_tail
 
     # Handle profiles first
     if args.profile:
@@ -475,6 +2683,22 @@ def _maid_init(args):
         # remove from binaries
         for ext in args.no_binary:
             _binaries.discard(ext.replace(".", "").lower())
+            _text_exts.add(ext.replace(".", "").lower())
+
+    _binary_detection = args.binary_detection
+
+    # The settings of the maid.json files matching a file win over this one
+    if args.sample_size is not None:
+        rules.insert(
+            0,
+            {
+                "name": "sampling --sample-size",
+                "pattern": "*",
+                "sample_size": args.sample_size,
+                "head": args.sample_head,
+                "tail": args.sample_tail,
+            },
+        )
 
     return patterns, rules
 
@@ -486,6 +2710,8 @@ def _dump_conf(patterns, rules):
 
     print("\n=== Active Rules ===")
     for rule in rules:
+        if not _is_rule(rule):
+            continue
         print(f"- {rule['name']}")
         print(f"  Pattern: {rule['pattern']}")
         print(f"  Start: {rule['start']}")
@@ -494,14 +2720,52 @@ def _dump_conf(patterns, rules):
             print(f"  Keep Start: {rule['keep_start']}")
         print()
 
+    signatures = [rule for rule in rules if "signature" in rule]
+    if signatures:
+        print("\n=== Added Signatures ===")
+        for rule in signatures:
+            print(f"- {rule['signature']} at {rule['offset']}: {rule['type']}")
+
+    sampling = [rule for rule in rules if "sample_size" in rule]
+    if sampling:
+        print("\n=== Sampling ===")
+        for rule in sampling:
+            print(
+                f"- {rule['pattern']} over {rule['sample_size']} bytes:"
+                f" {rule['head']} first and {rule['tail']} last lines"
+            )
+
+
+def _parse_size(value):
+    """
+    Parse a size in bytes, with an optional K, M or G (binary) suffix. Integers
+    are taken as they are.
+
+    Raises:
+        ValueError: If the size is not valid.
+    """
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    match = re.fullmatch(r"\s*(\d+)\s*([KMG]?)B?\s*", str(value), re.I)
+    if not match:
+        raise ValueError(f"invalid size: {value!r}")
+    return int(match.group(1)) * units[match.group(2).upper()]
+
+
+def _size_arg(value):
+    # _parse_size(), as an argparse type
+    try:
+        return _parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-def main():
-    global matcher
 
+def main():
     parser = argparse.ArgumentParser(
         description="Create an aggregated Markdown file from directories and files."
     )
-    parser.add_argument("paths", nargs="+", help="Directories or files to process")
+    parser.add_argument("paths", nargs="*", help="Directories or files to process")
     parser.add_argument(
         "-o",
         "--output",
@@ -535,16 +2799,165 @@ def main():
         "--no-binary", action="append", help="File extensions to treat as non-binary"
     )
 
+    parser.add_argument(
+        "--binary-detection",
+        choices=["fast", "strict"],
+        default="fast",
+        help="Tell binary files by their first %d bytes (fast, default) or by "
+        "decoding them whole (strict)" % SNIFF_SIZE,
+    )
+
+    parser.add_argument(
+        "--files-from",
+        metavar="FILE",
+        help="Process the files listed in FILE ('-' for stdin), one per line or "
+        "NUL separated",
+    )
+
+    parser.add_argument(
+        "--git-tracked",
+        action="store_true",
+        help="Only process the files tracked by git, read from the git index",
+    )
+
+    parser.add_argument(
+        "--no-follow-symlinks",
+        dest="follow_symlinks",
+        action="store_false",
+        help="Skip symbolic links instead of following them",
+    )
+
+    parser.add_argument(
+        "--order",
+        choices=["dfs", "bfs"],
+        default="dfs",
+        help="Walk directories depth-first (default) or breadth-first",
+    )
+
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        help="Do not descend more than MAX_DEPTH levels below the given paths",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of threads listing directories (default: 1)",
+    )
+
+    parser.add_argument(
+        "-P",
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes rendering files (default: 1)",
+    )
+
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse the rendered content of the files unchanged since the last run",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        help="Cache directory, implies --cache (default: $XDG_CACHE_HOME/maid)",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep the output file up to date as files change (Linux only)",
+    )
+
+    parser.add_argument(
+        "--max-files",
+        type=int,
+        metavar="N",
+        help="Stop after N files",
+    )
+
+    parser.add_argument(
+        "--max-bytes",
+        type=_size_arg,
+        metavar="SIZE",
+        help="Stop before reading more than SIZE bytes of files (eg. 500K, 10M)",
+    )
+
+    parser.add_argument(
+        "--max-file-size",
+        type=_size_arg,
+        metavar="SIZE",
+        help="Skip the files larger than SIZE bytes",
+    )
+
+    parser.add_argument(
+        "--sample-size",
+        type=_size_arg,
+        metavar="SIZE",
+        help="Render the text files larger than SIZE bytes as their first and"
+        " last lines",
+    )
+
+    parser.add_argument(
+        "--sample-head",
+        type=int,
+        default=SAMPLE_HEAD,
+        metavar="N",
+        help=f"Lines kept from the start of a sampled file (default: {SAMPLE_HEAD})",
+    )
+
+    parser.add_argument(
+        "--sample-tail",
+        type=int,
+        default=SAMPLE_TAIL,
+        metavar="N",
+        help=f"Lines kept from the end of a sampled file (default: {SAMPLE_TAIL})",
+    )
+
+    parser.add_argument(
+        "--max-output-bytes",
+        type=_size_arg,
+        metavar="SIZE",
+        help="Stop before the output file grows over SIZE bytes",
+    )
+
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="Stop after SECONDS seconds",
+    )
+
     parser.add_argument("--version", action="version", version=f"%(prog)s {VERSION}")
 
     args = parser.parse_args()
 
     if args.log:
-        logging.basicConfig(
-            stream=sys.stdout,
-            level=logging.INFO,
-            format="%(asctime)s - %(levelname)s - %(message)s",
-        )
+        _init_logging()
+
+    if not args.paths and not args.files_from:
+        parser.error("no paths to process, give PATHS or --files-from")
+
+    if args.watch and not sys.platform.startswith("linux"):
+        parser.error("--watch needs Linux inotify")
+
+    if args.sample_head < 0 or args.sample_tail < 0:
+        parser.error("--sample-head and --sample-tail cannot be negative")
+
+    limits = (
+        args.max_files,
+        args.max_bytes,
+        args.max_file_size,
+        args.max_output_bytes,
+        args.timeout,
+    )
+    if args.watch and any(limit is not None for limit in limits):
+        parser.error("--watch cannot be used with the --max-* and --timeout budgets")
+    budget = _Budget(*limits)
 
     patterns = []
     rules = []
@@ -556,19 +2969,21 @@ def main():
 
     logging.info(f"Ignored patterns: {patterns}")
 
-    markdown_content = [
-        "# Content\n\nThis file was generated by [Maid](https://github.com/fsoft72/maid) v%s - by [Fabio Rotondo](https://github.com/fsoft72)\n\n"
-        % VERSION
-    ]
-
-    for path in args.paths:
-        if os.path.isdir(path):
-            logging.info(f"Scanning directory: {path}")
+    file_list = read_file_list(args.files_from) if args.files_from else []
 
-            scan_directory(path, markdown_content, patterns, rules)
+    cache = None
+    if args.cache or args.cache_dir:
+        cache = RenderCache(args.cache_dir or default_cache_dir())
 
-    with open(args.output, "w", encoding="utf-8") as f:
-        f.write("".join(markdown_content))
+    try:
+        if args.watch:
+            _watch(args, file_list, patterns, rules, cache)
+        else:
+            _write_content(args, file_list, patterns, rules, budget, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+            logging.info(f"Cache: {cache.hits} files reused, {cache.misses} rendered")
 
     logging.info(f"Markdown file created: {args.output}")
 
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# flake8: noqa: E203
+
+import os
+import re
+import struct
+import sys
+from typing import List, Optional, Tuple
+
+# Entry modes, see gitformat-index(5)
+MODE_DIR = 0o040000  # sparse directory entry
+MODE_GITLINK = 0o160000  # submodule
+
+_HEADER = struct.Struct(">4sII")
+_MODE = struct.Struct(">I")
+_FLAGS = struct.Struct(">H")
+_FLAG_EXTENDED = 0x4000
+_EXT_SKIP_WORKTREE = 0x4000
+
+
+def find_repository(path: str) -> Optional[Tuple[str, str]]:
+    """Find the git repository a path belongs to.
+
+    Args:
+        path (str): A path inside a work tree.
+
+    Returns:
+        Optional[Tuple[str, str]]: The `(work_tree, git_dir)` absolute paths, or
+        None if `path` is not inside a work tree. `.git` files (as used by
+        linked work trees and submodules) are followed.
+    """
+    work_tree = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(work_tree, ".git")
+        if os.path.isdir(dot_git):
+            return work_tree, dot_git
+        if os.path.isfile(dot_git):
+            with open(dot_git, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+            if content.startswith("gitdir:"):
+                git_dir = os.path.join(work_tree, content[len("gitdir:") :].strip())
+                return work_tree, os.path.normpath(git_dir)
+
+        parent = os.path.dirname(work_tree)
+        if parent == work_tree:
+            return None
+        work_tree = parent
+
+
+def _hash_size(git_dir: str) -> int:
+    # SHA-256 repositories declare it in the config of the common git dir
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, "commondir")
+    if os.path.isfile(commondir_file):
+        with open(commondir_file, "r", encoding="utf-8") as f:
+            common_dir = os.path.join(git_dir, f.read().strip())
+
+    try:
+        with open(os.path.join(common_dir, "config"), "r", encoding="utf-8") as f:
+            config = f.read()
+    except OSError:
+        return 20
+
+    sha256 = re.search(r"^\s*objectformat\s*=\s*sha256\s*$", config, re.M | re.I)
+    return 32 if sha256 else 20
+
+
+def _varint(data: bytes, pos: int) -> Tuple[int, int]:
+    # The offset encoding of git, used by the path prefix compression of index v4
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, pos
+
+
+def read_index(index_path: str, hash_size: int = 20) -> List[Tuple[str, int, int]]:
+    """Read the entries of a git index file (versions 2, 3 and 4).
+
+    Args:
+        index_path (str): The index file.
+        hash_size (int): The size of the object ids, 20 (SHA-1) or 32 (SHA-256).
+
+    Returns:
+        List[Tuple[str, int, int]]: The `(name, mode, flags)` of the entries, in
+        index order. `name` is relative to the work tree and uses "/", `flags`
+        holds the stage and the skip-worktree bit of the extended flags.
+
+    Raises:
+        ValueError: If the file is not a supported git index, or is truncated.
+    """
+    with open(index_path, "rb") as f:
+        data = f.read()
+
+    try:
+        return _parse_index(data, index_path, hash_size)
+    except (struct.error, IndexError):
+        raise ValueError(f"Truncated git index: {index_path}")
+
+
+def _parse_index(
+    data: bytes, index_path: str, hash_size: int
+) -> List[Tuple[str, int, int]]:
+    signature, version, count = _HEADER.unpack_from(data, 0)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"Unsupported git index: {index_path}")
+
+    # Same as os.fsdecode(), without a call per entry
+    encoding = sys.getfilesystemencoding()
+    entries = []
+    name = b""
+    pos = _HEADER.size
+    for _ in range(count):
+        start = pos
+        # ctime, mtime, dev, ino, then the mode
+        mode = _MODE.unpack_from(data, pos + 24)[0]
+        pos += 40 + hash_size
+        flags = _FLAGS.unpack_from(data, pos)[0]
+        pos += 2
+        if flags & _FLAG_EXTENDED:
+            extended = _FLAGS.unpack_from(data, pos)[0]
+            pos += 2
+            if extended & _EXT_SKIP_WORKTREE:
+                flags |= _EXT_SKIP_WORKTREE << 16
+
+        if version == 4:
+            strip, pos = _varint(data, pos)
+            end = data.index(b"\0", pos)
+            name = name[: len(name) - strip] + data[pos:end]
+            pos = end + 1
+        else:
+            end = data.index(b"\0", pos)
+            name = data[pos:end]
+            # Entries are padded with 1 to 8 NULs to a multiple of 8 bytes
+            pos = start + ((end - start + 8) & ~7)
+
+        entries.append((name.decode(encoding, "surrogateescape"), mode, flags))
+
+    # Split indexes keep most of the entries in a shared index file
+    while pos + 8 <= len(data) - hash_size:
+        ext, size = struct.unpack_from(">4sI", data, pos)
+        if ext == b"link":
+            raise ValueError(f"Split git index not supported: {index_path}")
+        pos += 8 + size
+
+    return entries
+
+
+def tracked_files(work_tree: str, git_dir: str) -> List[str]:
+    """Return the files tracked in a work tree, reading its git index.
+
+    Submodules, sparse directories and the files not checked out (skip-worktree)
+    are left out, files with merge conflicts are listed once.
+
+    Args:
+        work_tree (str): The work tree, as returned by `find_repository()`.
+        git_dir (str): The git directory, as returned by `find_repository()`.
+
+    Returns:
+        List[str]: The file names, relative to `work_tree` and using "/".
+
+    Raises:
+        ValueError: If the index is not supported (eg. a split index), or is
+            truncated.
+    """
+    index_path = os.path.join(git_dir, "index")
+    if not os.path.isfile(index_path):
+        return []
+
+    files = []
+    last = None
+    for name, mode, flags in read_index(index_path, _hash_size(git_dir)):
+        if mode in (MODE_GITLINK, MODE_DIR) or flags & (_EXT_SKIP_WORKTREE << 16):
+            continue
+        # The stages of a conflicted file are consecutive
+        if name != last:
+            files.append(name)
+            last = name
+
+    return files
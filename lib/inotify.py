@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# flake8: noqa: E203
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+from typing import List, Optional, Tuple
+
+# Events, see inotify(7)
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+# Events sent by the kernel
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# Watch flags
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+
+# inotify_init1() flags
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    A minimal inotify(7) wrapper, calling the C library with ctypes.
+
+    Only available on Linux: creating an instance raises OSError anywhere else.
+
+    Internal Attributes:
+        _libc (ctypes.CDLL): The C library.
+        _fd (int): The inotify file descriptor.
+
+    Public Methods:
+        add_watch(path, mask) -> int:
+            Watch a path, returning the watch descriptor.
+        rm_watch(wd):
+            Stop watching a watch descriptor.
+        read_events(timeout) -> list[tuple]:
+            Wait for events and return them.
+        close():
+            Close the inotify file descriptor.
+
+    Examples:
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmp, Inotify() as inotify:
+        ...     wd = inotify.add_watch(tmp, IN_CREATE)
+        ...     open(os.path.join(tmp, "a.txt"), "w").close()
+        ...     [(w == wd, mask, name) for w, mask, _, name in inotify.read_events(1)]
+        [(True, 256, 'a.txt')]
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        try:
+            self._libc = ctypes.CDLL(libc_name, use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self._libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = self._check(init(IN_CLOEXEC | IN_NONBLOCK))
+
+    def __enter__(self) -> "Inotify":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _check(self, res: int) -> int:
+        if res < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return res
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch a path for the events in `mask`.
+
+        Args:
+            path (str): The file or directory to watch.
+            mask (int): The events to watch and the watch flags.
+
+        Returns:
+            int: The watch descriptor, the same for an already watched path.
+        """
+        return self._check(
+            self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        )
+
+    def rm_watch(self, wd: int) -> None:
+        """Stop watching a watch descriptor."""
+        self._check(self._libc.inotify_rm_watch(self._fd, wd))
+
+    def read_events(
+        self, timeout: Optional[float] = None
+    ) -> List[Tuple[int, int, int, str]]:
+        """Wait for events and return them.
+
+        Args:
+            timeout (Optional[float]): How long to wait for the first event, in
+                seconds. None waits forever.
+
+        Returns:
+            list[tuple]: The `(wd, mask, cookie, name)` events, `name` is the
+            name of the file inside a watched directory, or "" for the watched
+            path itself. Empty if no event came before the timeout.
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos : pos + size].rstrip(b"\0")
+            pos += size
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+
+        return events
+
+    def close(self) -> None:
+        """Close the inotify file descriptor."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -4,8 +4,310 @@
 
 import re
 import os
+import itertools
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Union, Sequence
+from typing import Collection, Iterable, Optional, Union, Sequence
+
+_GLOB_CHARS = frozenset("*?[")
+
+# Every new set of compiled layers gets a new id, used as key in MatchCache
+_layers_ids = itertools.count()
+
+
+class _TrieNode:
+    """
+    A node of the pattern segments trie.
+
+    Edges are labelled with pattern segments: literal segments are looked up in
+    `literals`, glob segments are tested with their compiled regex and the "**"
+    segment leads to `anything`, a node that loops on itself to match one or more
+    path components. `accept` holds the lowest index of the patterns ending here,
+    `negated` tells if any of them is an exclusion pattern and `live` if one can
+    still be reached walking one or more further components.
+    """
+
+    __slots__ = ("literals", "globs", "anything", "loop", "accept", "negated", "live")
+
+    def __init__(self, loop: bool = False):
+        self.literals: dict[str, "_TrieNode"] = {}
+        self.globs: dict[str, tuple] = {}
+        self.anything: Optional["_TrieNode"] = None
+        self.loop = loop
+        self.accept: Optional[int] = None
+        self.negated = False
+        self.live = False
+
+    def child(self, segment: str, regex: Optional[str]) -> "_TrieNode":
+        """Return the child node for a segment, creating it if needed."""
+        if segment == "**":
+            if self.anything is None:
+                self.anything = _TrieNode(loop=True)
+            return self.anything
+
+        if regex is None:
+            return self.literals.setdefault(segment, _TrieNode())
+
+        if segment not in self.globs:
+            self.globs[segment] = (re.compile(regex).fullmatch, _TrieNode())
+        return self.globs[segment][1]
+
+    def mark_live(self) -> bool:
+        """Set `live` on this node and all its descendants and return it."""
+        children = [*self.literals.values(), *(c for _, c in self.globs.values())]
+        if self.anything is not None:
+            children.append(self.anything)
+
+        self.live = self.loop and self.negated
+        for child in children:
+            if child.mark_live() or child.negated:
+                self.live = True
+
+        return self.live
+
+
+class _CompiledPatterns:
+    """
+    The immutable, compiled form of an optimized list of patterns.
+
+    Patterns are sorted into classes at compile time. Exact basenames (".git"),
+    extensions ("*.log") and basename prefixes ("build*") are answered with dict
+    lookups on the path basename, so that they cost the same no matter how many
+    patterns are active. Other globs without a "/" are matched against the
+    basename by a single combined regex, patterns spanning more path components
+    ("src/**/*.py") are walked component by component in a trie and only globs
+    that can match across a "/" ("a**b") fall back to a regex on the full path.
+
+    Every lookup maps its key to the index of the pattern in `entries`: the
+    lowest matching index is the winning pattern.
+    """
+
+    __slots__ = (
+        "entries",
+        "literals",
+        "extensions",
+        "prefixes",
+        "names",
+        "names_regex",
+        "trie",
+        "trie_first",
+        "globs",
+        "globs_regex",
+        "negated_paths",
+        "negated_globs",
+    )
+
+    EMPTY: "_CompiledPatterns"
+
+    def __init__(self, entries: tuple, classified: Sequence[tuple]):
+        """Build the lookup tables.
+
+        Args:
+            entries (tuple): The (pattern, is_negation) pairs, in matching order.
+            classified (Sequence[tuple]): One (kind, key) pair per entry, as
+                returned by PatternMatcher._classify().
+        """
+        self.entries = entries
+        self.literals: dict[str, int] = {}
+        self.extensions: dict[str, int] = {}
+        self.prefixes: dict[int, dict[str, int]] = {}
+        self.trie = _TrieNode()
+        self.trie_first: Optional[int] = None
+        self.negated_paths = False
+        self.negated_globs: list = []
+        names = []
+        globs = []
+
+        # setdefault() keeps the first (winning) index for duplicated keys
+        for index, (kind, key) in enumerate(classified):
+            if kind == "literal":
+                self.literals.setdefault(key, index)
+            elif kind == "extension":
+                self.extensions.setdefault(key, index)
+            elif kind == "prefix":
+                self.prefixes.setdefault(len(key), {}).setdefault(key, index)
+            elif kind == "name":
+                names.append((index, key))
+            elif kind == "path":
+                node = self.trie
+                for segment, regex in key:
+                    node = node.child(segment, regex)
+                if node.accept is None:
+                    node.accept = index
+                if self.trie_first is None:
+                    self.trie_first = index
+                if entries[index][1]:
+                    node.negated = self.negated_paths = True
+            else:
+                globs.append((index, key))
+                if entries[index][1]:
+                    self.negated_globs.append(re.compile(f"{key}$").match)
+
+        if self.negated_paths:
+            self.trie.mark_live()
+
+        self.names, self.names_regex = self._combine(names, "")
+
+        # Each alternative carries its own optional "any parent dirs" prefix, so
+        # that the first pattern matching any path suffix wins, as in the pattern
+        # order, regardless of the suffix length
+        self.globs, self.globs_regex = self._combine(globs, "(?s:.*/)?")
+
+    @staticmethod
+    def _combine(items: Sequence[tuple], prefix: str) -> tuple:
+        if not items:
+            return (), None
+
+        regex = "|".join(f"{prefix}(?P<p{index}>{body})$" for index, body in items)
+        return tuple(index for index, _ in items), re.compile(regex)
+
+    def trie_states(
+        self, parts: Sequence[str], states=(), restart: bool = True
+    ) -> Collection:
+        """Return the active trie nodes after walking some path components.
+
+        Args:
+            parts (Sequence[str]): The path components to walk.
+            states (Collection, optional): The active nodes to start from, as
+                returned by a previous call. Defaults to none.
+            restart (bool, optional): Whether a match can also start on any of
+                the walked components, as it happens in match_index(), or only
+                continue the `states` ones. Defaults to True.
+        """
+        # Every component may start a new match, so the root is always active
+        root = (self.trie,) if restart else ()
+        for part in parts:
+            following = set()
+            for node in (*root, *states):
+                if node.loop:
+                    following.add(node)
+                child = node.literals.get(part)
+                if child is not None:
+                    following.add(child)
+                if node.globs:
+                    for fullmatch, child in node.globs.values():
+                        if fullmatch(part):
+                            following.add(child)
+                if node.anything is not None:
+                    following.add(node.anything)
+            states = following
+
+        return states
+
+    def match_index(self, filepath: str, parent_states=None) -> Optional[int]:
+        """Return the index of the first entry matching a normalized path.
+
+        Args:
+            filepath (str): The normalized path.
+            parent_states (Collection, optional): The trie_states() of the path
+                parent directory, if already known. Defaults to None.
+        """
+        best = None
+        basename = filepath[filepath.rfind("/") + 1 :]
+
+        index = self.literals.get(basename)
+        if index is not None:
+            best = index
+
+        if self.extensions:
+            dot = basename.find(".")
+            while dot != -1:
+                index = self.extensions.get(basename[dot:])
+                if index is not None and (best is None or index < best):
+                    best = index
+                dot = basename.find(".", dot + 1)
+
+        for length, table in self.prefixes.items():
+            index = table.get(basename[:length])
+            if index is not None and (best is None or index < best):
+                best = index
+
+        # Each of the following returns its lowest matching index, so they are
+        # only worth running if they could beat the best hit found so far
+        if self.names_regex is not None and (best is None or self.names[0] < best):
+            m = self.names_regex.match(basename)
+            if m and (best is None or self.names[m.lastindex - 1] < best):
+                best = self.names[m.lastindex - 1]
+
+        if self.trie_first is not None and (best is None or self.trie_first < best):
+            if parent_states is None:
+                states = self.trie_states(filepath.split("/"))
+            else:
+                states = self.trie_states((basename,), parent_states)
+            for node in states:
+                if node.accept is not None and (best is None or node.accept < best):
+                    best = node.accept
+
+        if self.globs_regex is not None and (best is None or self.globs[0] < best):
+            m = self.globs_regex.match(filepath)
+            if m and (best is None or self.globs[m.lastindex - 1] < best):
+                best = self.globs[m.lastindex - 1]
+
+        return best
+
+
+_CompiledPatterns.EMPTY = _CompiledPatterns((), ())
+
+
+class MatchCache:
+    """
+    A bounded LRU cache of PatternMatcher verdicts.
+
+    Entries are keyed on the id of the compiled set of patterns and on the
+    normalized path, so a single cache can be shared by many matchers (a matcher
+    shares its cache with all its children). Changing the patterns of a matcher
+    gives it a new id, so the old verdicts are never returned again and are
+    eventually evicted. The cache is safe to use from more threads.
+
+    Public properties:
+        maxsize (int): The maximum number of verdicts kept.
+        hits (int): The number of lookups answered by the cache.
+        misses (int): The number of lookups not found in the cache.
+
+    Examples:
+        >>> matcher = PatternMatcher(["*.log"], cache_size=1024)
+        >>> matcher.matches("a.log"), matcher.matches("a.log")
+        (True, True)
+        >>> matcher.cache.hits, matcher.cache.misses
+        (1, 1)
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> Optional[bool]:
+        """Return the cached verdict for a key, or None if it is not cached."""
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return verdict
+
+    def put(self, key: tuple, verdict: bool) -> None:
+        """Store a verdict, evicting the least recently used ones if needed."""
+        with self._lock:
+            self._entries[key] = verdict
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all the cached verdicts and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
 
 
 class PatternMatcher:
@@ -19,15 +321,37 @@ class PatternMatcher:
     Internal Attributes:
         _patterns (list[str]): A list of patterns to match against.
         _optimized (bool): A flag indicating whether the patterns have been optimized.
+        _compiled (_CompiledPatterns): The compiled form of the optimized patterns.
+        _head (int): The number of compiled patterns that were exclusion patterns
+            before optimization, and so take precedence over the parent ones.
+        _parent (PatternMatcher): The matcher this one was derived from by child().
+        _layers (tuple[tuple[_CompiledPatterns, int], ...]): The compiled patterns
+            and head of every matcher from the root one down to this one.
+        _layers_id (int): The id of _layers, used as key in the cache.
 
     Public properties:
         patterns (list[str]): A list of optimized patterns.
+        cache (MatchCache): The verdicts cache, or None if caching is disabled.
 
     Internal Methods:
-        __init__(patterns: Sequence[str] = None):
+        __init__(patterns: Sequence[str] = None, cache_size: int = 0):
             Initialize a new PatternMatcher instance.
         _ensure_optimized() -> None:
-            Ensure the patterns are optimized for matching.
+            Ensure the patterns are optimized and compiled for matching.
+        _compile(patterns: Sequence[str]) -> _CompiledPatterns:
+            Sort optimized patterns into lookup classes and compile them.
+        _classify(pattern: str) -> tuple:
+            Return the lookup class of a normalized pattern and its lookup key.
+        _get_layers() -> tuple:
+            Return the compiled layers of this matcher and of all its parents.
+        _first_entry(layers: tuple, filepath: str, states: tuple = None) -> tuple:
+            Return the winning (pattern, is_negation) entry for a normalized path.
+        _match_entry(filepath: Union[str, Path]) -> Optional[tuple]:
+            Return the winning (pattern, is_negation) entry for a filepath.
+        _prepare_path(filepath: Union[str, Path]) -> str:
+            Convert a filepath to the normalized string used for matching.
+        _below(filepath: Union[str, Path], ignored: Union[str, Path]) -> tuple:
+            Split a path in the components of an ignored directory and the rest.
         _normalize_path(path: str) -> str:
             Normalize a file path by stripping leading "./" or "/".
         _convert_to_regex(pattern: str) -> str:
@@ -38,29 +362,57 @@ class PatternMatcher:
             Add a single pattern to the matcher.
         add_patterns(patterns: Sequence[str]) -> None:
             Add multiple patterns to the matcher.
+        child(patterns: Sequence[str]) -> PatternMatcher:
+            Return a new matcher extending this one with more patterns.
         matches(filepath: Union[str, Path]) -> bool:
             Check if a filepath matches any of the patterns.
+        matches_many(filepaths: Iterable[Union[str, Path]]) -> list[bool]:
+            Check a whole list of filepaths at once.
+        matches_in(parent: Union[str, Path], names: Iterable[str]) -> list[bool]:
+            Check all the entries of a directory listing at once.
+        match_pattern(filepath: Union[str, Path]) -> Optional[str]:
+            Return the pattern that decides the verdict for a filepath.
+        may_reinclude(dirpath: Union[str, Path], ignored: Union[str, Path] = None)
+            -> bool:
+            Check if an exclusion pattern can re-include something below a
+            directory that matched the patterns.
+        is_reincluded(filepath: Union[str, Path], ignored: Union[str, Path]) -> bool:
+            Check if a path below a directory that matched the patterns is
+            re-included by an exclusion pattern.
     """
 
-    def __init__(self, patterns: Sequence[str] = None):
+    def __init__(self, patterns: Sequence[str] = None, cache_size: int = 0):
         """Initialize a new PatternMatcher instance.
 
         Args:
             patterns (Sequence[str], optional): A sequence of patterns to add.
                 Each pattern can be a glob pattern or an exclusion pattern starting
                 with "!". Defaults to None.
+            cache_size (int, optional): The number of verdicts to keep in an LRU
+                cache, shared with the children matchers. Defaults to 0, that
+                disables the cache.
 
         Examples:
             >>> matcher = PatternMatcher(["*.py", "!test_*.py"])
         """
         self._patterns: list[str] = []
+        self._compiled = _CompiledPatterns.EMPTY
+        self._head = 0
         self._optimized = False
+        self._parent: Optional[PatternMatcher] = None
+        self._inherited: tuple = ()
+        self._layers: Optional[tuple] = None
+        self._layers_id = 0
+        self.cache = MatchCache(cache_size) if cache_size > 0 else None
         if patterns:
             self.add_patterns(patterns)
 
     def _ensure_optimized(self) -> None:
         if not self._optimized:
             self._patterns.sort(key=lambda x: not x.startswith("!"))
+            self._head = len(
+                dict.fromkeys(p.strip() for p in self._patterns if p.startswith("!"))
+            )
             self._patterns = [
                 p.replace("\\", "/")
                 for p in [  # Normalize pattern separators
@@ -68,8 +420,112 @@ class PatternMatcher:
                     for p in dict.fromkeys(p.strip() for p in self._patterns)
                 ]
             ]
+            self._compiled = self._compile(self._patterns)
+            self._layers = None
             self._optimized = True
 
+    def _get_layers(self) -> tuple:
+        self._ensure_optimized()
+        inherited = self._parent._get_layers() if self._parent is not None else ()
+
+        if self._layers is None or self._inherited is not inherited:
+            self._inherited = inherited
+            if self._compiled.entries:
+                self._layers = inherited + ((self._compiled, self._head),)
+            else:
+                self._layers = inherited
+            self._layers_id = next(_layers_ids)
+
+        return self._layers
+
+    @staticmethod
+    def _first_entry(layers: tuple, filepath: str, states: tuple = None):
+        # This is the same order of a single matcher holding all the patterns: the
+        # exclusion patterns of every layer first, then the rest of every layer
+        found = []
+        for i, (compiled, head) in enumerate(layers):
+            parent_states = None if states is None else states[i]
+            index = compiled.match_index(filepath, parent_states)
+            if index is not None:
+                if index < head:
+                    return compiled.entries[index]
+                found.append(compiled.entries[index])
+
+        return found[0] if found else None
+
+    def _compile(self, patterns: Sequence[str]) -> _CompiledPatterns:
+        entries = []
+        classified = []
+        for pattern in patterns:
+            if not pattern or pattern.startswith("#"):
+                continue
+
+            is_negation = pattern.startswith("!")
+            body = self._normalize_path(pattern[1:] if is_negation else pattern)
+            entries.append((pattern, is_negation))
+            classified.append(self._classify(body))
+
+        return _CompiledPatterns(tuple(entries), classified)
+
+    def _classify(self, pattern: str) -> tuple:
+        if not _GLOB_CHARS.intersection(pattern):
+            if "/" not in pattern:
+                return "literal", pattern
+        elif "/" not in pattern and "**" not in pattern:
+            head, tail = pattern[:-1], pattern[1:]
+            if pattern[0] == "*" and tail[:1] == ".":
+                if not _GLOB_CHARS.intersection(tail):
+                    return "extension", tail
+            if pattern[-1] == "*" and not _GLOB_CHARS.intersection(head):
+                return "prefix", head
+
+        # Brackets are copied as they are into the regex: if they can match a "/"
+        # the pattern cannot be split into path components
+        i = pattern.find("[")
+        while i != -1:
+            j = pattern.find("]", i + 1)
+            if j == -1:
+                break
+            if j == i + 1 or pattern[i + 1] == "^" or "/" in pattern[i + 1 : j]:
+                return "glob", self._convert_to_regex(pattern)[1:-1]
+            i = pattern.find("[", j + 1)
+
+        segments = []
+        for segment in pattern.split("/"):
+            if segment == "**" or not _GLOB_CHARS.intersection(segment):
+                segments.append((segment, None))
+            elif "**" not in segment:
+                segments.append((segment, self._convert_to_regex(segment)[1:-1]))
+            else:
+                # "**" inside a segment matches across "/" as well
+                return "glob", self._convert_to_regex(pattern)[1:-1]
+
+        if len(segments) == 1 and segments[0][0] != "**":
+            return "name", segments[0][1]
+
+        return "path", segments
+
+    def _match_entry(self, filepath: Union[str, Path]) -> Optional[tuple]:
+        layers = self._get_layers()
+        return self._first_entry(layers, self._prepare_path(filepath))
+
+    def _prepare_path(self, filepath: Union[str, Path]) -> str:
+        # Convert Path objects to string and normalize separators
+        if isinstance(filepath, Path):
+            filepath = str(filepath)
+
+        return self._normalize_path(self._normalize_path(filepath))
+
+    def _below(self, filepath: Union[str, Path], ignored: Union[str, Path]) -> tuple:
+        ignored = self._prepare_path(ignored)
+        filepath = self._prepare_path(filepath)
+        if filepath != ignored and not filepath.startswith(ignored + "/"):
+            raise ValueError(f"{filepath} is not below {ignored}")
+
+        parts = filepath.split("/")
+        depth = ignored.count("/") + 1
+        return parts[:depth], parts[depth:]
+
     def _normalize_path(self, path: str) -> str:
         # Convert path to use forward slashes
         path = path.replace("\\", "/")
@@ -141,6 +597,34 @@ class PatternMatcher:
         self._patterns.extend(patterns)
         self._optimized = False
 
+    def child(self, patterns: Sequence[str]) -> "PatternMatcher":
+        """Return a new matcher extending this one with more patterns.
+
+        The new matcher gives the same results as a single matcher holding the
+        patterns of both, but it shares the compiled patterns of this one and only
+        compiles the new ones. Patterns added later to the child do not change
+        this matcher.
+
+        Args:
+            patterns (Sequence[str]): The patterns to add in the child matcher.
+
+        Returns:
+            PatternMatcher: The child matcher.
+
+        Examples:
+            >>> matcher = PatternMatcher(["*.log"])
+            >>> child = matcher.child(["*.tmp"])
+            >>> child.matches("a.tmp"), matcher.matches("a.tmp")
+            (True, False)
+        """
+        # Compile the parent now, so that children can be shared between threads
+        self._get_layers()
+
+        child = PatternMatcher(patterns)
+        child._parent = self
+        child.cache = self.cache
+        return child
+
     def clear_patterns(self) -> None:
         """Clear all patterns from the matcher.
 
@@ -151,6 +635,7 @@ class PatternMatcher:
             []
         """
         self._patterns.clear()
+        self._parent = None
         self._optimized = False
 
     def matches(self, filepath: Union[str, Path]) -> bool:
@@ -171,34 +656,210 @@ class PatternMatcher:
             >>> matcher.matches("test_foo.py")
             False
         """
-        # Convert Path objects to string and normalize separators
-        if isinstance(filepath, Path):
-            filepath = str(filepath)
-        filepath = self._normalize_path(filepath)
+        layers = self._get_layers()
+        filepath = self._prepare_path(filepath)
 
-        self._ensure_optimized()
-        filepath = self._normalize_path(str(filepath))
+        if self.cache is not None:
+            key = (self._layers_id, filepath)
+            verdict = self.cache.get(key)
+            if verdict is not None:
+                return verdict
 
-        for pattern in self._patterns:
-            if not pattern or pattern.startswith("#"):
-                continue
+        entry = self._first_entry(layers, filepath)
+        verdict = entry is not None and not entry[1]
 
-            is_negation = pattern.startswith("!")
-            pattern = self._normalize_path(pattern[1:] if is_negation else pattern)
-            regex = self._convert_to_regex(pattern)
+        if self.cache is not None:
+            self.cache.put(key, verdict)
+
+        return verdict
+
+    def matches_many(self, filepaths: Iterable[Union[str, Path]]) -> list[bool]:
+        """Check a whole list of filepaths at once.
+
+        This gives the same results as calling matches() on every path, but the
+        work on the parent directories is done only once for all their entries.
+
+        Args:
+            filepaths (Iterable[Union[str, Path]]): The paths to check.
+
+        Returns:
+            list[bool]: The matches() verdict of every path, in the same order.
+
+        Examples:
+            >>> matcher = PatternMatcher(["src/*.pyc", "!src/keep.pyc"])
+            >>> matcher.matches_many(["src/a.pyc", "src/keep.pyc", "a.pyc"])
+            [True, False, False]
+        """
+        layers = self._get_layers()
+        has_trie = any(compiled.trie_first is not None for compiled, _ in layers)
+        parents: dict = {}
+        verdicts = []
+
+        for filepath in filepaths:
+            filepath = self._prepare_path(filepath)
+
+            if self.cache is not None:
+                key = (self._layers_id, filepath)
+                verdict = self.cache.get(key)
+                if verdict is not None:
+                    verdicts.append(verdict)
+                    continue
+
+            states = None
+            if has_trie:
+                parent, sep, _ = filepath.rpartition("/")
+                parent_key = parent if sep else None
+                states = parents.get(parent_key)
+                if states is None:
+                    parts = parent.split("/") if sep else ()
+                    states = tuple(c.trie_states(parts) for c, _ in layers)
+                    parents[parent_key] = states
+
+            entry = self._first_entry(layers, filepath, states)
+            verdicts.append(entry is not None and not entry[1])
+
+            if self.cache is not None:
+                self.cache.put(key, verdicts[-1])
+
+        return verdicts
+
+    def matches_in(self, parent: Union[str, Path], names: Iterable[str]) -> list[bool]:
+        """Check all the entries of a directory listing at once.
+
+        Args:
+            parent (Union[str, Path]): The directory containing the entries.
+            names (Iterable[str]): The entry names, as returned by os.listdir().
+
+        Returns:
+            list[bool]: The matches() verdict of every entry, in the same order.
+
+        Examples:
+            >>> matcher = PatternMatcher(["*.log"])
+            >>> matcher.matches_in("logs", ["a.log", "a.txt"])
+            [True, False]
+        """
+        parent = str(parent)
+        return self.matches_many(os.path.join(parent, name) for name in names)
+
+    def match_pattern(self, filepath: Union[str, Path]) -> Optional[str]:
+        """Return the pattern that decides the verdict for a filepath.
 
-            path_parts = filepath.split("/")
-            if any(
-                re.match(regex, "/".join(path_parts[i:]))
-                for i in range(len(path_parts))
-            ):
-                return not is_negation
+        Patterns are tried in the same order used by matches(), so exclusion
+        patterns always take precedence over the other ones.
+
+        Args:
+            filepath (Union[str, Path]): The path to check against the patterns.
+
+        Returns:
+            Optional[str]: The winning pattern (exclusion patterns keep their
+                leading "!"), or None if no pattern matches the path.
+
+        Examples:
+            >>> matcher = PatternMatcher(["*.py", "!test_*.py"])
+            >>> matcher.match_pattern("test_foo.py")
+            '!test_*.py'
+            >>> matcher.match_pattern("foo.txt") is None
+            True
+        """
+        entry = self._match_entry(filepath)
+        return None if entry is None else entry[0]
+
+    def may_reinclude(
+        self, dirpath: Union[str, Path], ignored: Union[str, Path] = None
+    ) -> bool:
+        """Check if an exclusion pattern can re-include something below a
+        directory that matched the patterns.
+
+        Only exclusion patterns naming a path through the ignored directory, such
+        as "!build/keep.txt" for "build", can re-include its content: a plain
+        "!keep.txt" does not. When this returns False the whole directory can be
+        skipped without looking at its content.
+
+        Args:
+            dirpath (Union[str, Path]): The directory to check.
+            ignored (Union[str, Path], optional): The directory that matched the
+                patterns, `dirpath` itself or one of its parents. Defaults to
+                `dirpath`.
+
+        Returns:
+            bool: True if some path below `dirpath` can be re-included.
+
+        Examples:
+            >>> matcher = PatternMatcher(["build/", "!build/keep/*.txt"])
+            >>> matcher.may_reinclude("build"), matcher.may_reinclude("build/tmp")
+            (True, False)
+        """
+        if ignored is None:
+            ignored = dirpath
+        ignored_parts, rest = self._below(dirpath, ignored)
+
+        for compiled, _ in self._get_layers():
+            # Globs spanning a "/" are not split in components: be conservative
+            if compiled.negated_globs:
+                return True
+
+            if compiled.negated_paths:
+                states = compiled.trie_states(ignored_parts)
+                states = compiled.trie_states(rest, states, restart=False)
+                if any(node.live for node in states):
+                    return True
+
+        return False
+
+    def is_reincluded(
+        self, filepath: Union[str, Path], ignored: Union[str, Path]
+    ) -> bool:
+        """Check if a path below a directory that matched the patterns is
+        re-included by an exclusion pattern.
+
+        The path is re-included if it does not match the patterns itself and an
+        exclusion pattern naming a path through the ignored directory matches it.
+
+        Args:
+            filepath (Union[str, Path]): The path to check.
+            ignored (Union[str, Path]): The directory, parent of `filepath`, that
+                matched the patterns.
+
+        Returns:
+            bool: True if the path is re-included.
+
+        Examples:
+            >>> matcher = PatternMatcher(["build/", "!build/keep/*.txt"])
+            >>> matcher.is_reincluded("build/keep/a.txt", "build")
+            True
+            >>> matcher.is_reincluded("build/keep/a.log", "build")
+            False
+        """
+        ignored_parts, rest = self._below(filepath, ignored)
+        if not rest or self.matches(filepath):
+            return False
+
+        suffixes = None
+        for compiled, _ in self._get_layers():
+            if compiled.negated_paths:
+                states = compiled.trie_states(ignored_parts)
+                states = compiled.trie_states(rest, states, restart=False)
+                if any(node.negated for node in states):
+                    return True
+
+            if compiled.negated_globs:
+                if suffixes is None:
+                    parts = ignored_parts + rest
+                    suffixes = [
+                        "/".join(parts[i:]) for i in range(len(ignored_parts))
+                    ]
+                for match in compiled.negated_globs:
+                    if any(match(suffix) for suffix in suffixes):
+                        return True
 
         return False
 
     @property
     def patterns(self) -> list[str]:
         self._ensure_optimized()
+        if self._parent is not None:
+            return PatternMatcher(self._parent.patterns + self._patterns).patterns
+
         return self._patterns.copy()
 
 
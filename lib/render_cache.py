@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# flake8: noqa: E203
+
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Optional
+
+# Files modified this close to the moment they were checked may change again
+# without changing their stat info (eg. on file systems with coarse timestamps)
+RACY_NS = 2 * 10**9
+
+
+def now_ns() -> int:
+    """Return the current time, in ns since the epoch."""
+    return int(time.time() * 10**9)
+
+
+def content_digest(data: bytes) -> str:
+    """Return the hex digest of some content, the same `file_digest()` gives."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(file_path: str, block_size: int = 1 << 20) -> str:
+    """Return the hex digest of the content of a file."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def default_cache_dir() -> str:
+    """Return the default cache directory, `$XDG_CACHE_HOME/maid` or `~/.cache/maid`."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "maid")
+
+
+class RenderCache:
+    """
+    A persistent cache of rendered files, stored in a SQLite database.
+
+    For every file the cache keeps the stat info (size, mtime and inode) and the
+    digest of the content the chunk was rendered from, along with the hash of the
+    ruleset used. A cached chunk is reused if the file has the same stat info or,
+    when the stat info changed (eg. the file was touched), the same content.
+
+    Internal Attributes:
+        _db (sqlite3.Connection): The database connection.
+
+    Public properties:
+        path (str): The database file.
+        hits (int): The number of chunks reused.
+        misses (int): The number of files to render again.
+
+    Public Methods:
+        get(file_path, name, stat, ruleset) -> Optional[tuple]:
+            Return the cached `(chunk, binary)` of a file, if still valid.
+        put(file_path, name, stat, checked_ns, digest, ruleset, chunk, binary):
+            Store the chunk of a file.
+        commit():
+            Save the changes.
+        close():
+            Save the changes and close the database.
+    """
+
+    def __init__(self, cache_dir: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "render-cache.sqlite3")
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(self.path)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                checked_ns INTEGER NOT NULL,
+                digest TEXT,
+                ruleset TEXT NOT NULL,
+                binary INTEGER NOT NULL,
+                chunk TEXT NOT NULL
+            )
+            """
+        )
+
+    def get(self, file_path: str, name: str, stat, ruleset: str) -> Optional[tuple]:
+        """Return the cached chunk of a file, if it is still valid.
+
+        Args:
+            file_path (str): The absolute path of the file, the cache key.
+            name (str): The path of the file as shown in the chunk.
+            stat (os.stat_result): The current stat info of the file.
+            ruleset (str): The hash of the rules and settings for the file.
+
+        Returns:
+            Optional[tuple]: The `(chunk, binary)` tuple, or None if the file
+            has to be rendered again.
+        """
+        row = self._db.execute(
+            "SELECT name, size, mtime_ns, inode, checked_ns, digest, ruleset,"
+            " binary, chunk FROM files WHERE path = ?",
+            (file_path,),
+        ).fetchone()
+
+        if row is None or row[0] != name or row[6] != ruleset:
+            self.misses += 1
+            return None
+
+        _, size, mtime_ns, inode, checked_ns, digest, _, binary, chunk = row
+        same_stat = (size, mtime_ns, inode) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        )
+        if same_stat and mtime_ns + RACY_NS < checked_ns:
+            self.hits += 1
+            return chunk, bool(binary)
+
+        # The stat info is not enough, compare the content
+        if digest is not None and size == stat.st_size:
+            try:
+                same_content = file_digest(file_path) == digest
+            except OSError:
+                same_content = False
+            if same_content:
+                self._db.execute(
+                    "UPDATE files SET mtime_ns = ?, inode = ?, checked_ns = ?"
+                    " WHERE path = ?",
+                    (stat.st_mtime_ns, stat.st_ino, now_ns(), file_path),
+                )
+                self.hits += 1
+                return chunk, bool(binary)
+
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        file_path: str,
+        name: str,
+        stat,
+        checked_ns: int,
+        digest: Optional[str],
+        ruleset: str,
+        chunk: str,
+        binary: bool,
+    ) -> None:
+        """Store the chunk of a file.
+
+        Args:
+            file_path (str): The absolute path of the file, the cache key.
+            name (str): The path of the file as shown in the chunk.
+            stat (os.stat_result): The stat info of the file, taken before it
+                was rendered.
+            checked_ns (int): When `stat` was taken, in ns since the epoch.
+            digest (Optional[str]): The digest of the content, see
+                `file_digest()`. None if the content must not be compared.
+            ruleset (str): The hash of the rules and settings for the file.
+            chunk (str): The rendered chunk.
+            binary (bool): Whether the file was treated as binary.
+        """
+        self._db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                file_path,
+                name,
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ino,
+                checked_ns,
+                digest,
+                ruleset,
+                int(binary),
+                chunk,
+            ),
+        )
+
+    def commit(self) -> None:
+        """Save the changes."""
+        self._db.commit()
+
+    def close(self) -> None:
+        """Save the changes and close the database."""
+        self._db.commit()
+        self._db.close()
@@ -18,7 +18,13 @@ setup(
     url="https://github.com/fsoft72/maid",
     license="MIT",
     packages=find_packages(),
-    py_modules=["fsoft_maid", "lib.pattern_matcher"],
+    py_modules=[
+        "fsoft_maid",
+        "lib.git_index",
+        "lib.inotify",
+        "lib.pattern_matcher",
+        "lib.render_cache",
+    ],
     entry_points={
         "console_scripts": [
             "maid=fsoft_maid:main",
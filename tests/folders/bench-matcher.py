@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import argparse
+import bz2
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT)
+
+from fsoft_maid import PATTERNS, PROFILES  # noqa: E402
+from lib.pattern_matcher import PatternMatcher  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "folder-structure.txt.bz2")
+
+
+def load_paths(bz2_file, limit=None):
+    # Paths are streamed from the fixture, nothing is read from the file system
+    paths = []
+    with bz2.open(bz2_file, "rt") as f:
+        for line in f:
+            paths.append(line.strip())
+            if limit and len(paths) >= limit:
+                break
+    return paths
+
+
+def synthetic_patterns(paths, count, seed=42):
+    """
+    Build `count` patterns out of the fixture names, mixing all the pattern kinds:
+    plain names, extensions, prefixes, globs, paths and exclusion patterns.
+    """
+    rnd = random.Random(seed)
+    names = sorted({p.rsplit("/", 1)[-1] for p in paths})
+    dirs = sorted({p.rsplit("/", 1)[0] for p in paths if "/" in p} - {"."})
+    dirs = [d[2:] if d.startswith("./") else d for d in dirs]
+    exts = sorted({n.rsplit(".", 1)[-1] for n in names if "." in n})
+
+    patterns = []
+    while len(patterns) < count:
+        kind = len(patterns) % 7
+        name = rnd.choice(names)
+        if kind == 0:
+            patterns.append(name)
+        elif kind == 1:
+            patterns.append(f"*.{rnd.choice(exts)}")
+        elif kind == 2:
+            patterns.append(f"{name[:3]}*")
+        elif kind == 3:
+            patterns.append(f"*{name[1:4]}*.{rnd.choice(exts)}")
+        elif kind == 4:
+            patterns.append(f"{rnd.choice(dirs)}/*.{rnd.choice(exts)}")
+        elif kind == 5:
+            patterns.append(f"**/{name}")
+        else:
+            patterns.append(f"!{rnd.choice(dirs)}/{name}")
+    return patterns
+
+
+def percentile(values, pct):
+    index = min(len(values) - 1, int(len(values) * pct / 100))
+    return values[index]
+
+
+def bench(name, patterns, paths, repeat):
+    """
+    Time a PatternMatcher with the given patterns against all the paths.
+    """
+    start = time.perf_counter()
+    matcher = PatternMatcher(patterns)
+    matcher.matches("")  # forces the compilation
+    compile_time = time.perf_counter() - start
+
+    latencies = []
+    matched = 0
+    for _ in range(repeat):
+        for path in paths:
+            start = time.perf_counter_ns()
+            res = matcher.matches(path)
+            latencies.append(time.perf_counter_ns() - start)
+            matched += res
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        matcher.matches_many(paths)
+    batch_time = time.perf_counter() - start
+
+    total = sum(latencies) / 1e9
+    latencies.sort()
+    return {
+        "name": name,
+        "patterns": len(patterns),
+        "paths": len(paths) * repeat,
+        "matched": matched // repeat,
+        "compile_ms": round(compile_time * 1000, 3),
+        "paths_per_sec": round(len(latencies) / total) if total else None,
+        "batch_paths_per_sec": (
+            round(len(paths) * repeat / batch_time) if batch_time else None
+        ),
+        "p50_us": round(percentile(latencies, 50) / 1000, 3),
+        "p99_us": round(percentile(latencies, 99) / 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark PatternMatcher against the folder structure fixture"
+    )
+    parser.add_argument(
+        "bz2_file",
+        nargs="?",
+        default=FIXTURE,
+        help="Path to the bz2 file containing folder structure",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Number of passes over all the paths"
+    )
+    parser.add_argument("--limit", type=int, help="Only use the first LIMIT paths")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=[10, 100, 1000],
+        help="Sizes of the synthetic pattern sets",
+    )
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+
+    args = parser.parse_args()
+    paths = load_paths(args.bz2_file, args.limit)
+
+    scenarios = [
+        ("default", PATTERNS),
+        ("c#", PATTERNS + PROFILES["c#"]["patterns"]),
+    ]
+    for size in args.sizes:
+        scenarios.append((f"synthetic-{size}", synthetic_patterns(paths, size)))
+
+    report = {
+        "python": sys.version.split()[0],
+        "fixture": os.path.basename(args.bz2_file),
+        "results": [bench(n, p, paths, args.repeat) for n, p in scenarios],
+    }
+
+    res = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(res + "\n")
+    else:
+        print(res)
+
+
+if __name__ == "__main__":
+    main()